@@ -1,27 +1,113 @@
 import json
+import os
 
 import click
 from flask import Flask, redirect
 from flask_migrate import Migrate
-from graphene_file_upload.flask import FileUploadGraphQLView
 
+from .caches import (get_bloom_filter, init_bloom_filter,
+                     init_fingerprint_cache, init_postings_cache)
 from .configs import config_logger, graphql_logging_middleware
-from .graphql import schema
+from .configs.fingerprint import FINGERPRINT_PROFILES
+from .filters import get_stop_hashes, init_stop_hashes
+from .graphql import MetricsGraphQLView, schema
+from .indexes import (build_mmap_index, build_sharded_index,
+                      init_fingerprint_index)
+from .jobs import init_job_queue
+from .metrics import metrics
 from .models import db, initialize_database
+from .repositories import FingerprintRepository
+from .services import IngestService
+from .uploads import UploadRequest
 
 config_logger()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_file("configs/config.json", load=json.load)
 
 db.init_app(app)
 migrate = Migrate(app, db)
+metrics.init_app(app)
+init_fingerprint_index(app)
+init_fingerprint_cache(app)
+init_postings_cache(app)
+init_bloom_filter(app)
+init_stop_hashes(app)
+init_job_queue(app)
 
 @app.cli.command("initdb")
 def initdb():
     initialize_database(app)
 
 
+@app.cli.command("buildindex")
+@click.argument("path", required=False)
+def buildindex(path):
+    """Exports the fingerprint table into a memory-mapped index, split in
+    FINGERPRINT_INDEX_SHARDS shards when FINGERPRINT_INDEX is "sharded"
+    """
+    path = path or app.config["FINGERPRINT_INDEX_PATH"]
+
+    if app.config.get("FINGERPRINT_INDEX") == "sharded":
+        build_sharded_index(path, app.config["FINGERPRINT_INDEX_SHARDS"])
+    else:
+        build_mmap_index(path)
+
+
+@app.cli.command("buildbloom")
+def buildbloom():
+    """Rebuilds the Bloom filter over the stored hashes and saves it to
+    BLOOM_FILTER_PATH
+    """
+    bloom_filter = get_bloom_filter()
+
+    if bloom_filter is None:
+        raise click.ClickException("BLOOM_FILTER_PATH is not set")
+
+    repository = FingerprintRepository()
+    bloom_filter.build(repository.iter_postings(), repository.count())
+
+    click.echo("%(bytes)d bytes, %(hash_functions)d hash functions, "
+               "false positive rate %(false_positive_rate).4f"
+               % bloom_filter.stats())
+
+
+@app.cli.command("rebuildstophashes")
+@click.option("--min-songs", type=int,
+              help="Threshold instead of STOP_HASH_MIN_SONGS.")
+def rebuildstophashes(min_songs):
+    """Recomputes the stop hashes, the hashes stored in at least
+    STOP_HASH_MIN_SONGS songs; servers read them again once restarted
+    """
+    stop_hashes = get_stop_hashes()
+
+    if stop_hashes is None:
+        raise click.ClickException("STOP_HASH_MIN_SONGS is 0")
+
+    stop_hashes.min_songs = min_songs or stop_hashes.min_songs
+
+    count = stop_hashes.rebuild()
+    if count is None:
+        raise click.ClickException("could not rebuild the stop hashes")
+
+    click.echo("%d stop hashes stored in at least %d songs" % (
+        count, stop_hashes.min_songs))
+
+
+@app.cli.command("ingest")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--workers", type=int, default=os.cpu_count(),
+              help="Number of fingerprinting processes.")
+@click.option("--profile", type=click.Choice(list(FINGERPRINT_PROFILES)),
+              help="Fingerprint profile of the new songs, by default the "
+                   "FINGERPRINT_PROFILE setting.")
+def ingest(directory, workers, profile):
+    """Fingerprints and stores every new audio file under DIRECTORY"""
+    IngestService().ingest_directory(directory, workers=workers,
+                                     profile=profile)
+
+
 @app.route("/")
 def root():
     return redirect("/graphql")
@@ -29,7 +115,7 @@ def root():
 
 app.add_url_rule(
     "/graphql",
-    view_func=FileUploadGraphQLView.as_view(
+    view_func=MetricsGraphQLView.as_view(
         "graphq",
         schema=schema,
         graphiql=True,
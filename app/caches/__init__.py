@@ -0,0 +1,67 @@
+import atexit
+
+from flask import current_app
+
+from ..metrics import metrics
+
+from .bloom import BloomFilter
+from .fingerprint import FingerprintCache
+from .postings import PostingsCache
+
+
+def init_fingerprint_cache(app):
+    """Registers the fingerprint cache, unless FINGERPRINT_CACHE_MAX_SIZE
+    is 0
+    """
+    max_size = app.config.get("FINGERPRINT_CACHE_MAX_SIZE", 0)
+
+    if max_size:
+        app.extensions["fingerprint_cache"] = FingerprintCache(
+            app.config["FINGERPRINT_CACHE_PATH"], max_size)
+
+
+def init_postings_cache(app):
+    """Registers the postings cache, unless POSTINGS_CACHE_MAX_SIZE is 0"""
+    max_size = app.config.get("POSTINGS_CACHE_MAX_SIZE", 0)
+
+    if max_size:
+        postings_cache = app.extensions["postings_cache"] = \
+            PostingsCache(max_size,
+                          app.config.get("POSTINGS_CACHE_STAMP_PATH"),
+                          app.config.get("POSTINGS_CACHE_TTL_SECONDS"))
+
+        metrics.register("postings_cache", lambda: {
+            f"postings_cache_{name}": value
+            for name, value in postings_cache.stats().items()})
+
+
+def init_bloom_filter(app):
+    """Registers the Bloom filter over the stored hashes, unless
+    BLOOM_FILTER_PATH is empty
+    """
+    path = app.config.get("BLOOM_FILTER_PATH")
+
+    if path:
+        bloom_filter = app.extensions["bloom_filter"] = BloomFilter(
+            path, app.config.get("BLOOM_FILTER_CAPACITY", 10**7),
+            app.config.get("BLOOM_FILTER_ERROR_RATE", 0.01),
+            app.config.get("BLOOM_FILTER_SYNC_SECONDS", 60))
+
+        # the bits added since the last save, which is throttled
+        atexit.register(bloom_filter.save, force=True)
+
+        metrics.register("bloom_filter", lambda: {
+            f"bloom_filter_{name}": value
+            for name, value in bloom_filter.stats().items()})
+
+
+def get_bloom_filter():
+    return current_app.extensions.get("bloom_filter")
+
+
+def get_fingerprint_cache():
+    return current_app.extensions.get("fingerprint_cache")
+
+
+def get_postings_cache():
+    return current_app.extensions.get("postings_cache")
@@ -0,0 +1,250 @@
+import fcntl
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# set bits of every byte value, to count the bits set in the filter
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)],
+                     dtype=np.int64)
+
+
+def _positions(hashes, bits, functions):
+    """(functions, n) bit positions of every hash, by double hashing the
+    splitmix64 finaliser of the hash
+    """
+    mixed = np.asarray(hashes, dtype=np.int64).view(np.uint64) + \
+        np.uint64(0x9E3779B97F4A7C15)
+    mixed = (mixed ^ (mixed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    mixed = (mixed ^ (mixed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    mixed ^= mixed >> np.uint64(31)
+
+    first = mixed & np.uint64(0xFFFFFFFF)
+    step = (mixed >> np.uint64(32)) | np.uint64(1)
+
+    steps = np.arange(functions, dtype=np.uint64)[:, None]
+    return (first[None, :] + steps * step[None, :]) & np.uint64(bits - 1)
+
+
+class BloomFilter:
+    """Bloom filter over every hash stored in the fingerprint table.
+
+    A hash it does not contain is certainly not stored, so a recognition
+    can drop it before any lookup; one it contains is stored, but for a
+    `false_positive_rate` share of them. `build` sizes the bit array for
+    the table, at least `capacity` hashes at `error_rate`, and saves it to
+    `path`; the filter stays inactive, letting every hash through, until
+    that file exists, which is looked for every `sync_interval` seconds.
+
+    Stored fingerprints are added as they are written, and `save` merges
+    the bits of the file into memory and back, so processes sharing the
+    file converge. The hashes added since the last save are kept, to be
+    added again when the file turns out rebuilt with another size. Both
+    saving and reading back what other processes saved happen at most
+    every `sync_interval` seconds, as each goes through the whole file;
+    the bits still unsaved are written when the process exits.
+    """
+
+    def __init__(self, path, capacity, error_rate, sync_interval=60) -> None:
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.loaded = False
+
+        self._bits = None
+        self._functions = 0
+        self._mtime = None
+        self._dirty = False
+        self._added = []
+        self._set_bits = None
+        self._checked = None
+        self._saved = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        if self._bits is None and self._due(self._checked):
+            self.load()
+
+        return self._bits is not None
+
+    def load(self):
+        with self._lock:
+            self._read()
+            self._checked = time.monotonic()
+            warn = not self.loaded
+            self.loaded = True
+
+        if self._bits is not None:
+            logging.info("loaded a %d byte Bloom filter from %s",
+                         self._bits.nbytes, self.path)
+        elif warn:
+            logging.warning("no Bloom filter at %s, run flask buildbloom",
+                            self.path)
+
+    def build(self, postings, hashes=0):
+        """Rebuilds the filter from (hashes, song_ids, offsets) batches, as
+        FingerprintRepository.iter_postings streams them, sized for at
+        least `hashes` hashes, and saves it
+        """
+        capacity = max(self.capacity, hashes, 1)
+        bits = 1 << max(math.ceil(math.log2(
+            -capacity * math.log(self.error_rate) / math.log(2) ** 2)), 6)
+        functions = max(round(bits / capacity * math.log(2)), 1)
+
+        with self._lock:
+            self._bits = np.zeros(bits // 8, dtype=np.uint8)
+            self._functions = functions
+            self._set_bits = None
+            self.loaded = True
+
+        added = 0
+        for batch in postings:
+            with self._lock:
+                self._set(np.unique(batch[0]))
+            added += len(batch[0])
+
+        with self._lock:
+            self._write(merge=False)
+
+        logging.info("built a %d byte Bloom filter with %d functions from "
+                     "%d fingerprints", bits // 8, functions, added)
+
+        return added
+
+    def add(self, hashes):
+        if not self.active:
+            return
+
+        hashes = np.asarray(hashes, dtype=np.int64)
+
+        with self._lock:
+            self._set(hashes)
+            self._added.append(hashes)
+            self._dirty = True
+
+    def contains(self, hashes):
+        """Boolean mask of the `hashes` that may be stored"""
+        if not self.active:
+            return np.ones(len(hashes), dtype=bool)
+
+        self._refresh()
+
+        positions = _positions(hashes, self._bits.size * 8, self._functions)
+        found = self._bits[(positions >> np.uint64(3)).astype(np.intp)] >> \
+            (positions & np.uint64(7)).astype(np.uint8)
+
+        return (found & 1).all(axis=0).astype(bool)
+
+    def save(self, force=False):
+        """Writes the fingerprints added since the last save to the file,
+        unless it was saved less than `sync_interval` seconds ago and not
+        `force`
+        """
+        if not self._dirty or not self.active:
+            return
+
+        if not force and not self._due(self._saved):
+            return
+
+        with self._lock:
+            self._write(merge=True)
+
+    def stats(self):
+        if not self.active:
+            return {"bytes": 0, "false_positive_rate": 1.0}
+
+        with self._lock:
+            if self._set_bits is None:
+                self._set_bits = int(
+                    np.bincount(self._bits, minlength=256) @ _POPCOUNT)
+
+            fill = self._set_bits / (self._bits.size * 8)
+
+        return {
+            "bytes": self._bits.nbytes,
+            "hash_functions": self._functions,
+            "fill_ratio": fill,
+            "false_positive_rate": fill ** self._functions,
+        }
+
+    def _set(self, hashes):
+        positions = _positions(hashes, self._bits.size * 8, self._functions)
+        positions = positions.ravel()
+
+        np.bitwise_or.at(
+            self._bits, (positions >> np.uint64(3)).astype(np.intp),
+            np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        self._set_bits = None
+
+    def _due(self, last):
+        return last is None or \
+            time.monotonic() - last >= self.sync_interval
+
+    def _refresh(self):
+        """Merges in the file when another process saved it since, looking
+        at most every `sync_interval` seconds
+        """
+        if not self._due(self._checked):
+            return
+        self._checked = time.monotonic()
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+
+        if mtime != self._mtime:
+            with self._lock:
+                self._read()
+
+    def _read(self):
+        """Merges the saved bits into memory, or takes them when the file
+        was built with another size, adding again the hashes not saved yet
+        """
+        try:
+            with np.load(self.path) as saved:
+                bits = saved["bits"]
+                functions = int(saved["functions"])
+            mtime = os.stat(self.path).st_mtime_ns
+        except (OSError, KeyError, ValueError):
+            return
+
+        if self._bits is not None and self._bits.shape == bits.shape and \
+                self._functions == functions:
+            self._bits |= bits
+        else:
+            self._bits = bits
+            self._functions = functions
+
+            for hashes in self._added:
+                self._set(hashes)
+
+        self._mtime = mtime
+        self._set_bits = None
+
+    def _write(self, merge):
+        """Writes the bits to the file, first merging in the file when
+        `merge`, holding a lock on it so concurrent savers do not drop each
+        other's bits
+        """
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if merge:
+                self._read()
+
+            temporary = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            with open(temporary, "wb") as f:
+                np.savez(f, bits=self._bits, functions=self._functions)
+            os.replace(temporary, self.path)
+
+            self._mtime = os.stat(self.path).st_mtime_ns
+            self._dirty = False
+            self._added = []
+            self._saved = time.monotonic()
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+
+# share of max_size an eviction brings the cache down to, so the directory
+# is not scanned again on the next few writes
+EVICT_RATIO = 0.9
+
+
+class FingerprintCache:
+    """Keeps the fingerprints of audio files on local disk.
+
+    Entries are keyed by the file hash and the signature of the
+    FingerprintService that computed them, so changing any fingerprinting
+    parameter simply misses. Each entry is one .npz file holding the
+    sample rate and the (hashes, offsets) arrays of every channel; reading
+    one refreshes its mtime and the least recently used entries are removed
+    once the directory grows past `max_size` bytes.
+
+    The size of the directory is counted once and then kept up to date as
+    entries are written. Only once it passes `max_size` is the directory
+    scanned again, which also counts what other processes wrote, and
+    entries are removed until it is back under `EVICT_RATIO` of it.
+    """
+
+    def __init__(self, path, max_size) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, file_hash, signature):
+        """Returns {"Fs", "fingerprints": [(hashes, offsets), ...]} or None"""
+        filename = self._filename(file_hash, signature)
+
+        try:
+            with np.load(filename) as entry:
+                channels = int(entry["channels"])
+                cached = {
+                    "Fs": int(entry["Fs"]),
+                    "fingerprints": [
+                        (entry[f"hashes_{chn}"], entry[f"offsets_{chn}"])
+                        for chn in range(channels)
+                    ]
+                }
+
+            os.utime(filename)
+        except (OSError, KeyError, ValueError):
+            # missing, evicted meanwhile or half written by a killed process
+            return None
+
+        return cached
+
+    def contains(self, file_hash, signature):
+        return os.path.exists(self._filename(file_hash, signature))
+
+    def put(self, file_hash, signature, Fs, fingerprints):
+        filename = self._filename(file_hash, signature)
+
+        arrays = {"Fs": Fs, "channels": len(fingerprints)}
+        for chn, (hashes, offsets) in enumerate(fingerprints):
+            arrays[f"hashes_{chn}"] = hashes
+            arrays[f"offsets_{chn}"] = offsets
+
+        # created on the first entry, not whenever the app is loaded
+        os.makedirs(self.path, exist_ok=True)
+
+        # readers only ever see a complete entry
+        temporary = f"{filename}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(f, **arrays)
+            written = f.tell()
+        os.replace(temporary, filename)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += written
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _filename(self, file_hash, signature):
+        return os.path.join(self.path, f"{file_hash}-{signature}.npz")
+
+    def _entries(self):
+        """(mtime, size, path) of every entry in the directory"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".npz"):
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def _evict(self):
+        """Removes the least recently used entries; called holding the
+        lock
+        """
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+
+        for _, entry_size, filename in sorted(entries):
+            if size <= self.max_size * EVICT_RATIO:
+                break
+
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            size -= entry_size
+
+            logging.debug("evicted %s from the fingerprint cache", filename)
+
+        self._size = size
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# rough per entry cost of the dict slot, the key and the array object
+ENTRY_OVERHEAD = 200
+
+_NO_POSTINGS = np.empty(0, dtype=np.int64)
+
+
+class PostingsCache:
+    """Least recently used postings of the hashes looked up in the database.
+
+    Each hash maps to one int64 array packing song_id << 32 | offset, empty
+    for hashes that are not stored, so misses are remembered as well. The
+    entries are dropped once their estimated size goes past `max_size`
+    bytes, and whenever fingerprints of those hashes are stored.
+
+    The cache is per process. Storing or deleting fingerprints bumps the
+    mtime of the `stamp_path` file, and every process drops its whole cache
+    once it sees the stamp change, so songs stored elsewhere are found on
+    the next lookup. As a fallback for missed stamps, the cache is also
+    dropped every `ttl` seconds.
+    """
+
+    def __init__(self, max_size, stamp_path=None, ttl=None) -> None:
+        self.max_size = max_size
+        self.stamp_path = stamp_path
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._stamp = self._read_stamp()
+        self._cleared = time.monotonic()
+        self._lock = threading.Lock()
+
+    def lookup(self, hashes):
+        """Splits unique `hashes` into the cached postings, as (hashes,
+        song_ids, offsets) arrays, and the hashes still to be fetched. The
+        returned generation must be handed back to `store`.
+        """
+        found = []
+        missing = []
+        stamp = self._read_stamp()
+
+        with self._lock:
+            if stamp != self._stamp or self.ttl and \
+                    time.monotonic() - self._cleared >= self.ttl:
+                self._clear()
+                self._stamp = stamp
+
+            for hash in hashes.tolist():
+                postings = self._entries.get(hash)
+
+                if postings is None:
+                    missing.append(hash)
+                    continue
+
+                self._entries.move_to_end(hash)
+                if len(postings):
+                    found.append((hash, postings))
+
+            self.hits += len(hashes) - len(missing)
+            self.misses += len(missing)
+            generation = self._generation
+
+        if found:
+            packed = np.concatenate([postings for _, postings in found])
+            found_hashes = np.repeat(
+                np.array([hash for hash, _ in found], dtype=np.int64),
+                [len(postings) for _, postings in found])
+        else:
+            packed = found_hashes = _NO_POSTINGS
+
+        return ((found_hashes, packed >> 32, packed & 0xFFFFFFFF),
+                np.array(missing, dtype=np.int64), generation)
+
+    def store(self, queried, postings, generation):
+        """Caches the postings fetched for the unique hashes in `queried`,
+        unless fingerprints were stored since the matching `lookup`
+        """
+        hashes, song_ids, offsets = postings
+
+        order = np.argsort(hashes, kind="stable")
+        hashes = hashes[order]
+        packed = (song_ids[order] << 32) | offsets[order]
+        bounds = np.searchsorted(hashes, queried)
+        ends = np.searchsorted(hashes, queried, side="right")
+
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            for hash, start, end in zip(queried.tolist(), bounds.tolist(),
+                                        ends.tolist()):
+                entry = packed[start:end].copy() if end > start \
+                    else _NO_POSTINGS
+                self._add(hash, entry)
+
+            while self.size > self.max_size and self._entries:
+                _, entry = self._entries.popitem(last=False)
+                self.size -= entry.nbytes + ENTRY_OVERHEAD
+
+    def invalidate(self, hashes):
+        """Drops the entries of `hashes`, whose fingerprints were just
+        stored or deleted, and tells the other processes through the stamp
+        """
+        with self._lock:
+            self._generation += 1
+
+            for hash in np.unique(hashes).tolist():
+                entry = self._entries.pop(hash, None)
+                if entry is not None:
+                    self.size -= entry.nbytes + ENTRY_OVERHEAD
+
+        self._bump_stamp()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _clear(self):
+        self._entries.clear()
+        self.size = 0
+        self._generation += 1
+        self._cleared = time.monotonic()
+
+    def _read_stamp(self):
+        if self.stamp_path is None:
+            return None
+
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _bump_stamp(self):
+        if self.stamp_path is None:
+            return
+
+        try:
+            with open(self.stamp_path, "a"):
+                pass
+
+            # move past the previous stamp even on coarse clocks
+            stamp = max(time.time_ns(), os.stat(self.stamp_path)
+                        .st_mtime_ns + 1)
+            os.utime(self.stamp_path, ns=(stamp, stamp))
+        except OSError:
+            logging.exception("could not bump the postings cache stamp %s",
+                              self.stamp_path)
+
+    def _add(self, hash, entry):
+        previous = self._entries.pop(hash, None)
+        if previous is not None:
+            self.size -= previous.nbytes + ENTRY_OVERHEAD
+
+        self._entries[hash] = entry
+        self.size += entry.nbytes + ENTRY_OVERHEAD
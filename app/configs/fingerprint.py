@@ -27,6 +27,11 @@ DEFAULT_AMP_MIN = 10
 # fingerprints and faster matching, but can potentially affect accuracy.
 PEAK_NEIGHBORHOOD_SIZE = 20
 
+# Shape of that neighbourhood. "diamond" is the historical footprint;
+# "rectangle" is a square of the same radius, cheaper to compute but
+# covering twice the cells, so it yields fewer peaks (around half).
+PEAK_FILTER_SHAPE = "diamond"
+
 # Thresholds on how close or far fingerprints can be in time in order
 # to be paired as a fingerprint. If your max is too low, higher values of
 # DEFAULT_FAN_VALUE may not perform as expected.
@@ -38,7 +43,161 @@ MAX_HASH_TIME_DELTA = 200
 # affect performance.
 PEAK_SORT = True
 
-# Number of bits to throw away from the front of the SHA1 hash in the
-# fingerprint calculation. The more you throw away, the less storage, but
+# Number of hex digits kept from the front of the SHA1 hash in the
+# fingerprint calculation. The fewer you keep, the less storage, but
 # potentially higher collisions and misclassifications when identifying songs.
-FINGERPRINT_REDUCTION = 20
+# Hashes are stored as signed 64-bit integers, so at most 15 digits fit.
+FINGERPRINT_REDUCTION = 15
+
+# How peak pairs are turned into hashes. "int" packs (freq1, freq2, t_delta)
+# into a fixed-width integer with NumPy; "sha1" keeps the original truncated
+# SHA1 hex digest of "freq1|freq2|t_delta", many times slower.
+# Songs are fingerprinted with this mode and store it; queries are hashed
+# with every mode found in the catalog, so songs stored in "sha1" mode,
+# e.g. those converted by the 3b9d2e7c41a6 migration, keep matching until
+# they are fingerprinted again.
+FINGERPRINT_HASH_MODE = "int"
+FINGERPRINT_HASH_MODES = ("int", "sha1")
+
+# Bit widths of the fields packed into an "int" hash, laid out as
+# profile | freq1 | freq2 | t_delta from the most to the least significant
+# bits; the profile id takes the bits left above them.
+HASH_FREQ_BITS = 16
+HASH_DELTA_BITS = 16
+
+# Number of fingerprint rows written per statement (or per COPY on
+# PostgreSQL) and per transaction when storing a song's fingerprints.
+FINGERPRINT_INSERT_BATCH_SIZE = 10000
+
+# Number of rows fetched per round trip when reading the whole fingerprint
+# table, e.g. to load an in-memory index.
+FINGERPRINT_FETCH_BATCH_SIZE = 100000
+
+# Songs added to an in-memory index after it is loaded are kept as separate
+# sorted segments; past this many they are merged back into a single one.
+INDEX_MAX_SEGMENTS = 16
+
+# Number of candidate songs returned by a recognition, best first.
+RECOGNITION_TOP_N = 5
+
+# Recognitions against the database only align the postings of this many
+# songs with most matching fingerprints; 0 aligns every posting. The
+# database counts the matches and only the postings of those songs are
+# fetched, but for the hashes with at most RECOGNITION_CACHED_POSTINGS
+# postings, which are fetched whole to fill the postings cache. Once all
+# hashes of a sample are cached, the matches are counted in memory.
+RECOGNITION_CANDIDATE_SONGS = 50
+RECOGNITION_CACHED_POSTINGS = 1000
+
+# Ingesting a file also fills the fingerprint cache, unless it yields more
+# than this many hashes, which are then not held until the end of the file.
+FINGERPRINT_CACHE_MAX_HASHES = 2**20
+
+# Seconds of audio decoded at a time when a file is streamed, e.g. on ingest.
+AUDIO_CHUNK_SECONDS = 30
+
+# Uploads are kept in memory up to this many bytes and only spill to an
+# anonymous temporary file above it.
+UPLOAD_SPOOL_MAX_SIZE = 64 * 2**20
+
+# Incremental recognition fingerprints the sample this many seconds at a
+# time and stops as soon as the best song has at least
+# RECOGNITION_MIN_CONFIDENCE aligned matches and
+# RECOGNITION_CONFIDENCE_MARGIN times as many as the runner-up.
+RECOGNITION_SLICE_SECONDS = 2
+RECOGNITION_MIN_CONFIDENCE = 30
+RECOGNITION_CONFIDENCE_MARGIN = 2
+
+# Extensions of the files picked up when ingesting a whole directory.
+AUDIO_FILE_EXTENSIONS = (".aac", ".aiff", ".flac", ".m4a", ".mp3", ".ogg",
+                         ".opus", ".wav", ".wma")
+
+# Number of spectrogram frames windowed and transformed at a time; bounds
+# the temporary memory of the FFT stage.
+STFT_BLOCK_FRAMES = 256
+
+# Fingerprint profiles: how audio is prepared before the spectrogram and
+# how dense its fingerprints are.
+# "fs" resamples every channel to that rate (None keeps the file's rate),
+# "mono" averages the channels into one, and the window size is scaled
+# with the rate so frequency bins and frames keep the same width in Hz
+# and seconds. "fan_value", "amp_min", "neighborhood" and "max_delta"
+# replace DEFAULT_FAN_VALUE, DEFAULT_AMP_MIN, PEAK_NEIGHBORHOOD_SIZE and
+# MAX_HASH_TIME_DELTA. "peaks_per_second" and "hashes_per_second", when
+# set, keep only the strongest peaks of every second of a channel, so
+# loud, dense tracks get no more fingerprints than that.
+# A song stores the profile it was fingerprinted with and queries are
+# fingerprinted with every profile in the catalog. The "id" is packed
+# above the other fields of "int" hashes, so hashes of different profiles
+# never match each other.
+FINGERPRINT_PROFILES = {
+    "native": {
+        "id": 0,
+        "fs": None,
+        "mono": False,
+        "wsize": DEFAULT_WINDOW_SIZE,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": DEFAULT_FAN_VALUE,
+        "amp_min": DEFAULT_AMP_MIN,
+        "neighborhood": PEAK_NEIGHBORHOOD_SIZE,
+        "max_delta": MAX_HASH_TIME_DELTA,
+        "peaks_per_second": None,
+        "hashes_per_second": None,
+    },
+    "mono_11k": {
+        "id": 1,
+        "fs": 11025,
+        "mono": True,
+        "wsize": DEFAULT_WINDOW_SIZE // 4,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": DEFAULT_FAN_VALUE,
+        "amp_min": DEFAULT_AMP_MIN,
+        "neighborhood": PEAK_NEIGHBORHOOD_SIZE,
+        "max_delta": MAX_HASH_TIME_DELTA,
+        "peaks_per_second": None,
+        "hashes_per_second": None,
+    },
+    "fast": {
+        "id": 2,
+        "fs": 11025,
+        "mono": True,
+        "wsize": DEFAULT_WINDOW_SIZE // 4,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": 5,
+        "amp_min": DEFAULT_AMP_MIN,
+        "neighborhood": PEAK_NEIGHBORHOOD_SIZE,
+        "max_delta": MAX_HASH_TIME_DELTA // 2,
+        "peaks_per_second": 10,
+        "hashes_per_second": 40,
+    },
+    "balanced": {
+        "id": 3,
+        "fs": 22050,
+        "mono": True,
+        "wsize": DEFAULT_WINDOW_SIZE // 2,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": 10,
+        "amp_min": DEFAULT_AMP_MIN,
+        "neighborhood": PEAK_NEIGHBORHOOD_SIZE,
+        "max_delta": MAX_HASH_TIME_DELTA,
+        "peaks_per_second": 25,
+        "hashes_per_second": 200,
+    },
+    "accurate": {
+        "id": 4,
+        "fs": None,
+        "mono": False,
+        "wsize": DEFAULT_WINDOW_SIZE,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": DEFAULT_FAN_VALUE,
+        "amp_min": DEFAULT_AMP_MIN,
+        "neighborhood": PEAK_NEIGHBORHOOD_SIZE,
+        "max_delta": MAX_HASH_TIME_DELTA,
+        "peaks_per_second": 50,
+        "hashes_per_second": 700,
+    },
+}
+
+# Profile used when an upload does not ask for one and the FINGERPRINT_PROFILE
+# setting of the app does not name another.
+DEFAULT_FINGERPRINT_PROFILE = "native"
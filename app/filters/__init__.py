@@ -0,0 +1,22 @@
+from flask import current_app
+
+from ..metrics import metrics
+
+from .stop import StopHashes
+
+
+def init_stop_hashes(app):
+    """Registers the stop hashes, unless STOP_HASH_MIN_SONGS is 0"""
+    min_songs = app.config.get("STOP_HASH_MIN_SONGS", 0)
+
+    if min_songs:
+        stop_hashes = app.extensions["stop_hashes"] = StopHashes(
+            min_songs, app.config.get("STOP_HASH_SKIP_INGEST", False))
+
+        metrics.register("stop_hashes", lambda: {
+            f"stop_hashes_{name}": value
+            for name, value in stop_hashes.stats().items()})
+
+
+def get_stop_hashes():
+    return current_app.extensions.get("stop_hashes")
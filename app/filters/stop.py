@@ -0,0 +1,61 @@
+import logging
+import threading
+
+import numpy as np
+
+from ..repositories import StopHashRepository
+
+
+class StopHashes:
+    """Hashes stored in at least `min_songs` songs, e.g. from silence,
+    clicks or common drum patterns.
+
+    Their postings are long and barely tell songs apart, so recognitions
+    skip them and, with `skip_ingest`, new songs do not store them. The
+    set comes from the stop_hash table, recomputed by `rebuild`, and is
+    read on first use; other processes see a rebuild once restarted.
+    """
+
+    def __init__(self, min_songs, skip_ingest=False) -> None:
+        self.min_songs = min_songs
+        self.skip_ingest = skip_ingest
+        self.loaded = False
+
+        self._hashes = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+
+            self._hashes = StopHashRepository().get_hashes()
+            self.loaded = True
+
+            logging.info("loaded %d stop hashes", len(self._hashes))
+
+    def rebuild(self):
+        """Recomputes the stop_hash table from the fingerprint table and
+        returns the number of stop hashes, None when it failed
+        """
+        count = StopHashRepository().rebuild(self.min_songs)
+
+        if count is not None:
+            with self._lock:
+                self.loaded = False
+            self.load()
+
+        return count
+
+    def contains(self, hashes):
+        """Boolean mask of the stop hashes in `hashes`"""
+        if not self.loaded:
+            self.load()
+
+        return np.isin(np.asarray(hashes, dtype=np.int64), self._hashes)
+
+    def stats(self):
+        return {"count": len(self._hashes), "min_songs": self.min_songs}
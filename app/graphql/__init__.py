@@ -2,5 +2,6 @@ import graphene
 
 from .mutations import Mutations
 from .queries import Queries
+from .view import MetricsGraphQLView
 
 schema = graphene.Schema(query=Queries, mutation=Mutations)
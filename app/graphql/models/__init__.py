@@ -1 +1,3 @@
 from .example import Example
+from .recognition import RecognitionResult, SampleRecognition
+from .ingest_job import IngestJob
@@ -0,0 +1,34 @@
+from graphene import Float, Int, ObjectType, String
+
+
+class IngestJob(ObjectType):
+    id = String()
+    state = String()
+    filename = String()
+    song_id = Int()
+    channels = Int()
+    channels_done = Int()
+    seconds_decoded = Float()
+    hashes_stored = Int()
+    error = String()
+    queued_secs = Float()
+    elapsed_secs = Float()
+
+    @staticmethod
+    def from_job(job, now):
+        started = job["started_at"] or now
+        finished = job["finished_at"] or now
+
+        return IngestJob(
+            id=job["id"],
+            state=job["state"],
+            filename=job["filename"],
+            song_id=job["song_id"],
+            channels=job["channels"],
+            channels_done=job["channels_done"],
+            seconds_decoded=job["seconds_decoded"],
+            hashes_stored=job["hashes_stored"],
+            error=job["error"],
+            queued_secs=started - job["created_at"],
+            elapsed_secs=finished - started if job["started_at"] else 0.0,
+        )
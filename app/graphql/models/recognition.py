@@ -0,0 +1,24 @@
+from graphene import Float, Int, List, ObjectType, String
+
+
+class RecognitionResult(ObjectType):
+    song_id = Int()
+    song_name = String()
+    confidence = Int()
+    offset = Int()
+    offset_secs = Float()
+
+    @staticmethod
+    def from_match(match):
+        return RecognitionResult(
+            song_id=match["SONG_ID"],
+            song_name=match["SONG_NAME"],
+            confidence=match["CONFIDENCE"],
+            offset=match["OFFSET"],
+            offset_secs=match["OFFSET_SECS"],
+        )
+
+
+class SampleRecognition(ObjectType):
+    filename = String()
+    results = List(RecognitionResult)
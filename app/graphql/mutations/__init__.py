@@ -1,5 +1,6 @@
 from graphene import ObjectType
 
+from .music_batch_recognition import MusicBatchRecognitionMutation
 from .music_recognition import MusicRecognitionMutation
 from .music_uploader import MusicUploaderMutation
 
@@ -7,3 +8,4 @@ from .music_uploader import MusicUploaderMutation
 class Mutations(ObjectType):
     upload = MusicUploaderMutation.Field()
     recognition = MusicRecognitionMutation.Field()
+    recognize_batch = MusicBatchRecognitionMutation.Field()
@@ -0,0 +1,48 @@
+from contextlib import ExitStack
+from functools import partial
+
+from flask import current_app
+from graphene import Boolean, List, Mutation
+from graphene_file_upload.scalars import Upload
+
+from ...services import AudioService, SongService
+from ..models import RecognitionResult, SampleRecognition
+
+
+class MusicBatchRecognitionMutation(Mutation):
+    class Arguments:
+        sample_files = List(Upload, required=True)
+
+    success = Boolean()
+    samples = List(SampleRecognition)
+
+    def mutate(self, info, sample_files, **kwargs):
+        audio_service = AudioService()
+
+        with ExitStack() as stack:
+            samples = []
+            for sample_file in sample_files:
+                fileobj, file_hash = audio_service.spool(sample_file)
+                stack.enter_context(fileobj)
+
+                samples.append({
+                    "file_hash": file_hash,
+                    # decoded only when the fingerprint cache misses
+                    "decode": partial(
+                        audio_service.parse_audio, sample_file.filename,
+                        fileobj=fileobj, file_hash=file_hash),
+                })
+
+            matches = SongService.recognize_batch(
+                samples,
+                workers=current_app.config.get("RECOGNITION_BATCH_WORKERS"))
+
+        return MusicBatchRecognitionMutation(
+            success=True,
+            samples=[
+                SampleRecognition(
+                    filename=sample_file.filename,
+                    results=[RecognitionResult.from_match(song)
+                             for song in songs])
+                for sample_file, songs in zip(sample_files, matches)
+            ])
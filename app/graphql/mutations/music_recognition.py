@@ -1,32 +1,39 @@
-import os
-
-from graphene import Boolean, Mutation
+from graphene import Boolean, List, Mutation, String
 from graphene_file_upload.scalars import Upload
 
+from ...repositories import SongRepository
 from ...services import AudioService, SongService
+from ..models import RecognitionResult
 
 
 class MusicRecognitionMutation(Mutation):
     class Arguments:
         sample_file = Upload(required=True)
+        incremental = Boolean(default_value=False)
+        profile = String()
 
     success = Boolean()
+    results = List(RecognitionResult)
 
-    def mutate(self, info, sample_file, **kwargs):
-        songname, extension = os.path.splitext(sample_file.filename)
-
-        filename = songname+extension
-
-        sample_file.save(filename)
-
+    def mutate(self, info, sample_file, incremental=False, profile=None,
+               **kwargs):
         audio_service = AudioService()
 
-        audio = audio_service.parse_audio(filename)
-
-        song_service = SongService(audio)
+        fileobj, file_hash = audio_service.spool(sample_file)
 
-        song_service.recognize()
+        with fileobj:
+            # decoded only when the fingerprint cache misses; matched
+            # against the songs of one profile only when asked
+            song_service = SongService(
+                file_hash=file_hash,
+                decode=lambda: audio_service.parse_audio(
+                    sample_file.filename, fileobj=fileobj,
+                    file_hash=file_hash),
+                profiles=SongRepository().get_profiles(profile)
+                if profile else None)
 
-        os.remove(filename)
+            songs = song_service.recognize(incremental=incremental)
 
-        return MusicRecognitionMutation(success=True)
+        return MusicRecognitionMutation(
+            success=True,
+            results=[RecognitionResult.from_match(song) for song in songs])
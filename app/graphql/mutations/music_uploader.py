@@ -1,73 +1,24 @@
-import os
-
-from graphene import Boolean, Mutation
+from graphene import Boolean, Mutation, String
 from graphene_file_upload.scalars import Upload
 
-from ...repositories import FingerprintRepository, SongRepository
-from ...services import AudioService, FingerprintService
+from ...jobs import get_job_queue
+from ...services import AudioService
 
 
 class MusicUploaderMutation(Mutation):
     class Arguments:
         music_file = Upload(required=True)
+        profile = String()
 
     success = Boolean()
+    job_id = String()
 
-    def mutate(self, info, music_file, **kwargs):
-        songname, extension = os.path.splitext(music_file.filename)
-
-        filename = songname+extension
-
-        music_file.save(filename)
-
-        audio_service = AudioService()
-        fingerprint_service = FingerprintService()
-
-        song_repo = SongRepository()
-        fingerprint_repo = FingerprintRepository()
-
-        audio = audio_service.parse_audio(filename)
-
-        song = song_repo.get_by_file_hash(audio['file_hash'])
-
-        if not song:
-            song = song_repo.upsert(
-                {
-                    'name': filename,
-                    'file_hash': audio['file_hash']
-                }
-            )
-
-        hashes = set()
-        channel_amount = len(audio['channels'])
-
-        for channeln, channel in enumerate(audio['channels']):
-            msg = '   fingerprinting channel %d/%d'
-            print(msg % (channeln+1, channel_amount))
-
-            channel_hashes = fingerprint_service.fingerprint(
-                channel, Fs=audio['Fs'])
-            channel_hashes = set(channel_hashes)
-
-            msg = '   finished channel %d/%d, got %d hashes'
-            print(msg % (channeln+1, channel_amount, len(channel_hashes)))
-
-            hashes |= channel_hashes
-
-        msg = '   finished fingerprinting, got %d unique hashes'
-
-        fingerprints = []
-        for hash, offset in hashes:
-            fingerprints.append({
-                "hash": hash,
-                "offset": offset
-            })
-
-        msg = '   storing %d hashes in db' % len(fingerprints)
-        print(msg)
-
-        fingerprint_repo.upsert_bulk(fingerprints, song)
+    def mutate(self, info, music_file, profile=None, **kwargs):
+        # the job closes the buffer once the song is stored
+        fileobj, file_hash = AudioService().spool(music_file)
 
-        os.remove(filename)
+        job_id = get_job_queue().submit(
+            fileobj, music_file.filename, file_hash=file_hash,
+            profile=profile)
 
-        return MusicUploaderMutation(success=True)
+        return MusicUploaderMutation(success=True, job_id=job_id)
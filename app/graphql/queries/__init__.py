@@ -1,7 +1,16 @@
-from graphene import Field, ObjectType
+import time
 
-from ..models import Example
+from graphene import Field, ObjectType, String
+
+from ...jobs import get_job_queue
+from ..models import Example, IngestJob
 
 
 class Queries(ObjectType):
     example = Field(Example)
+    ingest_job = Field(IngestJob, id=String(required=True))
+
+    def resolve_ingest_job(self, info, id):
+        job = get_job_queue().get(id)
+
+        return IngestJob.from_job(job, time.time()) if job else None
@@ -0,0 +1,32 @@
+from flask import current_app, g
+from graphene_file_upload.flask import FileUploadGraphQLView
+
+from ..metrics import metrics
+
+
+class MetricsGraphQLView(FileUploadGraphQLView):
+    """Adds the time spent in each pipeline stage to the `extensions` of
+    the response when METRICS_GRAPHQL_EXTENSIONS is on
+    """
+
+    def dispatch_request(self):
+        if not (metrics.enabled and
+                current_app.config.get("METRICS_GRAPHQL_EXTENSIONS")):
+            return super().dispatch_request()
+
+        with metrics.collect_request() as stages:
+            g.metrics_stages = stages
+            return super().dispatch_request()
+
+    def encode(self, data, pretty=False):
+        stages = g.get("metrics_stages")
+
+        if stages and isinstance(data, dict):
+            extensions = dict(data.get("extensions") or {})
+            extensions["stages"] = {
+                stage: {"seconds": round(total, 6), "count": count}
+                for stage, (total, count) in stages.items()
+            }
+            data = dict(data, extensions=extensions)
+
+        return super().encode(data, pretty=pretty)
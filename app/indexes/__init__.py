@@ -0,0 +1,25 @@
+from flask import current_app
+
+from .base import FingerprintIndex
+from .memory import MemoryFingerprintIndex
+from .mmap import MmapFingerprintIndex, build_mmap_index
+from .sharded import ShardedFingerprintIndex, build_sharded_index
+
+
+def init_fingerprint_index(app):
+    """Registers the index named by FINGERPRINT_INDEX ("sql" uses none)"""
+    backend = app.config.get("FINGERPRINT_INDEX", "sql")
+
+    if backend == "memory":
+        app.extensions["fingerprint_index"] = MemoryFingerprintIndex()
+    elif backend == "mmap":
+        app.extensions["fingerprint_index"] = MmapFingerprintIndex(
+            app.config["FINGERPRINT_INDEX_PATH"])
+    elif backend == "sharded":
+        app.extensions["fingerprint_index"] = ShardedFingerprintIndex(
+            app.config["FINGERPRINT_INDEX_PATH"],
+            app.config["FINGERPRINT_INDEX_SHARDS"])
+
+
+def get_fingerprint_index():
+    return current_app.extensions.get("fingerprint_index")
@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class FingerprintIndex:
+    """Inverted fingerprint index: hash -> (song_id, offset) postings.
+
+    Postings live in one or more segments, each made of three parallel
+    arrays sorted by hash, so a lookup is a binary search per segment.
+    """
+
+    def __init__(self, segments=()) -> None:
+        self._segments = list(segments)
+
+    def __len__(self):
+        return sum(len(hashes) for hashes, _, _ in self._segments)
+
+    def get_postings_by_hashes(self, hashes):
+        """Returns the (hashes, song_ids, offsets) arrays stored for `hashes`"""
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+
+        found = [self._search(segment, hashes) for segment in self._segments]
+        found = [postings for postings in found if len(postings[0])]
+
+        if not found:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    @staticmethod
+    def _search(segment, hashes):
+        segment_hashes, song_ids, offsets = segment
+
+        starts = np.searchsorted(segment_hashes, hashes, side="left")
+        ends = np.searchsorted(segment_hashes, hashes, side="right")
+        counts = ends - starts
+
+        # expand every [start, end) range into the positions it covers
+        total = counts.sum()
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) \
+            + np.arange(total)
+
+        return (segment_hashes[positions], song_ids[positions],
+                offsets[positions])
+
+    @staticmethod
+    def _sorted_segment(hashes, song_ids, offsets):
+        order = np.argsort(hashes, kind="stable")
+
+        return (np.asarray(hashes, dtype=np.int64)[order],
+                np.asarray(song_ids, dtype=np.int32)[order],
+                np.asarray(offsets, dtype=np.int32)[order])
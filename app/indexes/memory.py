@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from ..configs.fingerprint import INDEX_MAX_SEGMENTS
+from ..repositories import FingerprintRepository
+from .base import FingerprintIndex
+
+
+class MemoryFingerprintIndex(FingerprintIndex):
+    """Keeps the whole fingerprint table in process memory.
+
+    The table is loaded on first use into one base segment and songs
+    ingested afterwards are added as small sorted segments, merged into one
+    once there are more than INDEX_MAX_SEGMENTS of them; the base is only
+    sorted again when the process restarts.
+    """
+
+    def __init__(self, repository=None, max_segments=INDEX_MAX_SEGMENTS) -> None:
+        super().__init__()
+        self.repository = repository or FingerprintRepository()
+        self.max_segments = max_segments
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+
+            started = time.perf_counter()
+            batches = list(self.repository.iter_postings())
+
+            empty = np.empty(0, dtype=np.int64)
+            columns = [np.concatenate(column) for column in
+                       zip(*batches, (empty, empty, empty))]
+            self._segments = [self._sorted_segment(*columns)]
+            self.loaded = True
+
+            logging.info("loaded %d fingerprints into memory in %.2fs",
+                         len(self), time.perf_counter() - started)
+
+    def add(self, song_id, hashes, offsets):
+        with self._lock:
+            # the table load will pick these rows up itself
+            if not self.loaded:
+                return
+
+            song_ids = np.full(len(hashes), song_id, dtype=np.int32)
+            loaded, added = self._segments[0], self._segments[1:]
+            added = added + [self._sorted_segment(hashes, song_ids, offsets)]
+
+            if len(added) > self.max_segments:
+                columns = [np.concatenate(column) for column in zip(*added)]
+                added = [self._sorted_segment(*columns)]
+
+            # swap the list as a whole so lookups never see it half built
+            self._segments = [loaded] + added
+
+    def get_postings_by_hashes(self, hashes):
+        if not self.loaded:
+            self.load()
+
+        return super().get_postings_by_hashes(hashes)
@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from ..configs.fingerprint import INDEX_MAX_SEGMENTS
+from ..repositories import FingerprintRepository
+from .base import FingerprintIndex
+
+MMAP_INDEX_COLUMNS = (
+    ("hashes", np.int64),
+    ("song_ids", np.int32),
+    ("offsets", np.int32),
+)
+
+
+def build_mmap_index(path, repository=None):
+    """Exports the fingerprint table into an index directory at `path`.
+
+    The directory holds one .npy file per column, sorted by hash. Files are
+    written next to the old ones and swapped in at the end, so processes
+    that still map the previous index keep reading a consistent copy.
+    """
+    repository = repository or FingerprintRepository()
+    started = time.perf_counter()
+    os.makedirs(path, exist_ok=True)
+
+    total = repository.count()
+    columns = [
+        np.lib.format.open_memmap(
+            os.path.join(path, f"{name}.npy.tmp"), mode="w+",
+            dtype=dtype, shape=(total,))
+        for name, dtype in MMAP_INDEX_COLUMNS
+    ]
+
+    position = 0
+    for batch in repository.iter_postings(ordered=True):
+        size = min(len(batch[0]), total - position)
+        for column, values in zip(columns, batch):
+            column[position:position + size] = values[:size]
+        position += size
+
+    for column, (name, _) in zip(columns, MMAP_INDEX_COLUMNS):
+        column.flush()
+
+        # rows deleted while exporting leave unused slots at the end
+        if position < total:
+            np.save(os.path.join(path, f"{name}.npy"), column[:position])
+            os.remove(column.filename)
+        else:
+            os.replace(column.filename, os.path.join(path, f"{name}.npy"))
+
+    logging.info("exported %d fingerprints to %s in %.2fs",
+                 position, path, time.perf_counter() - started)
+
+    return position
+
+
+class MmapFingerprintIndex(FingerprintIndex):
+    """Reads an index built by `build_mmap_index` through read-only mmaps.
+
+    Every worker maps the same files, so the catalog lives once in the OS
+    page cache however many processes serve recognition. Songs ingested by
+    this process after the index was built are kept as in-memory segments
+    until the next `flask buildindex`.
+    """
+
+    def __init__(self, path, max_segments=INDEX_MAX_SEGMENTS) -> None:
+        super().__init__()
+        self.path = path
+        self.max_segments = max_segments
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+
+            try:
+                self._segments = [tuple(
+                    np.load(os.path.join(self.path, f"{name}.npy"),
+                            mmap_mode="r")
+                    for name, _ in MMAP_INDEX_COLUMNS
+                )]
+            except FileNotFoundError:
+                # songs ingested until then are still found in this process
+                logging.warning("no fingerprint index in %s, run flask "
+                                "buildindex", self.path)
+                self._segments = [tuple(
+                    np.empty(0, dtype=dtype)
+                    for _, dtype in MMAP_INDEX_COLUMNS)]
+            self.loaded = True
+
+            logging.info("mapped %d fingerprints from %s",
+                         len(self), self.path)
+
+    def add(self, song_id, hashes, offsets):
+        if not self.loaded:
+            self.load()
+
+        with self._lock:
+            mapped, added = self._segments[0], self._segments[1:]
+
+            # the index can have been built after the song was stored
+            _, mapped_song_ids, _ = self._search(
+                mapped, np.unique(np.asarray(hashes, dtype=np.int64)))
+            if (mapped_song_ids == song_id).any():
+                return
+
+            song_ids = np.full(len(hashes), song_id, dtype=np.int32)
+            added = added + [self._sorted_segment(hashes, song_ids, offsets)]
+
+            if len(added) > self.max_segments:
+                columns = [np.concatenate(column) for column in zip(*added)]
+                added = [self._sorted_segment(*columns)]
+
+            self._segments = [mapped] + added
+
+    def get_postings_by_hashes(self, hashes):
+        if not self.loaded:
+            self.load()
+
+        return super().get_postings_by_hashes(hashes)
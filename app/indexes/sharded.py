@@ -0,0 +1,320 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from ..configs.fingerprint import INDEX_MAX_SEGMENTS
+from ..repositories import FingerprintRepository
+from .mmap import MMAP_INDEX_COLUMNS, MmapFingerprintIndex
+
+# multiplier of the Fibonacci hashing that spreads hashes over shards; the
+# raw hashes keep structure (frequencies, profile id) in their high bits
+SHARD_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_of(hashes, shards):
+    """Shard number of every hash in `hashes`"""
+    mixed = np.asarray(hashes, dtype=np.int64).view(np.uint64) * SHARD_MIX
+
+    return ((mixed >> np.uint64(32)) % np.uint64(shards)).astype(np.intp)
+
+
+def shard_path(path, shard):
+    return os.path.join(path, f"shard-{shard}")
+
+
+def build_sharded_index(path, shards, repository=None):
+    """Exports the fingerprint table into `shards` mmap indexes under `path`.
+
+    Each shard directory has the layout of `build_mmap_index` and holds the
+    hashes `shard_of` sends to it. The table is read once in hash order and
+    every shard's columns are appended to raw files, converted to .npy and
+    swapped in at the end.
+    """
+    repository = repository or FingerprintRepository()
+    started = time.perf_counter()
+
+    raw_files = []
+    for shard in range(shards):
+        os.makedirs(shard_path(path, shard), exist_ok=True)
+        raw_files.append([
+            open(os.path.join(shard_path(path, shard), f"{name}.raw.tmp"),
+                 "wb")
+            for name, _ in MMAP_INDEX_COLUMNS
+        ])
+
+    total = 0
+    try:
+        for batch in repository.iter_postings(ordered=True):
+            shard_ids = shard_of(batch[0], shards)
+
+            for shard, files in enumerate(raw_files):
+                rows = shard_ids == shard
+                for f, values, (_, dtype) in zip(files, batch,
+                                                 MMAP_INDEX_COLUMNS):
+                    values[rows].astype(dtype).tofile(f)
+
+            total += len(batch[0])
+    finally:
+        for files in raw_files:
+            for f in files:
+                f.close()
+
+    for shard in range(shards):
+        for name, dtype in MMAP_INDEX_COLUMNS:
+            raw = os.path.join(shard_path(path, shard), f"{name}.raw.tmp")
+            target = os.path.join(shard_path(path, shard), f"{name}.npy")
+
+            if os.path.getsize(raw):
+                column = np.memmap(raw, dtype=dtype, mode="r")
+            else:
+                column = np.empty(0, dtype=dtype)
+
+            with open(f"{target}.tmp", "wb") as f:
+                np.save(f, column)
+            del column
+
+            os.replace(f"{target}.tmp", target)
+            os.remove(raw)
+
+    logging.info("exported %d fingerprints to %d shards in %s in %.2fs",
+                 total, shards, path, time.perf_counter() - started)
+
+    return total
+
+
+def _serve_shard(path, max_segments, connection):
+    """Runs in a shard process: maps the shard's index, then answers the
+    commands sent over `connection` from it, in order, until told to stop
+    or the pipe is closed. A failing command is answered with its error
+    instead of stopping the process.
+    """
+    index = MmapFingerprintIndex(path, max_segments)
+    index.load()
+
+    while True:
+        try:
+            command, request_id, args = connection.recv()
+        except EOFError:
+            break
+
+        if command == "stop":
+            break
+
+        result = error = None
+        try:
+            if command == "lookup":
+                result = index.get_postings_by_hashes(*args)
+            elif command == "add":
+                index.add(*args)
+        except Exception as ex:
+            logging.exception("index shard %s could not %s", path, command)
+            error = "%s: %s" % (type(ex).__name__, ex)
+
+        if request_id is not None:
+            connection.send((request_id, result, error))
+
+
+class _ShardProcess:
+    """A shard process and the thread handing its answers, tagged with the
+    id of their request, to the lookups waiting for them, so any number of
+    lookups can be in flight at once
+    """
+
+    def __init__(self, context, path, max_segments) -> None:
+        self.path = path
+        self.alive = True
+
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve_shard, daemon=True,
+            args=(path, max_segments, child))
+        self.process.start()
+        child.close()
+
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        # the reader never takes this one, so a send blocked on a full pipe
+        # does not keep the answers from being read
+        self._send_lock = threading.Lock()
+
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def send(self, command, args, reply=False):
+        """Sends a command to the shard; returns a Future of its answer
+        when `reply`
+        """
+        future = Future() if reply else None
+        request_id = None
+
+        with self._lock:
+            if not self.alive:
+                raise RuntimeError("index shard %s stopped" % self.path)
+
+            if reply:
+                request_id = next(self._request_ids)
+                self._pending[request_id] = future
+
+        try:
+            with self._send_lock:
+                self.connection.send((command, request_id, args))
+        except (OSError, ValueError):
+            self._stopped()
+
+        return future
+
+    def close(self):
+        try:
+            with self._send_lock:
+                self.connection.send(("stop", None, ()))
+        except (OSError, ValueError):
+            pass
+
+        self.process.join()
+        self._reader.join()
+        self.connection.close()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, result, error = self.connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                future = self._pending.pop(request_id)
+
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(
+                    "index shard %s: %s" % (self.path, error)))
+
+        self._stopped()
+
+    def _stopped(self):
+        """Fails the lookups still waiting once the process is gone"""
+        with self._lock:
+            self.alive = False
+            pending, self._pending = self._pending, {}
+
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(
+                    "index shard %s stopped" % self.path))
+
+
+class ShardedFingerprintIndex:
+    """Scatter-gather over shard processes built by `build_sharded_index`.
+
+    Every shard is served by its own process mapping its part of the index;
+    a lookup splits the hashes by `shard_of`, sends every shard its part
+    before waiting for any answer, so the shards search in parallel, and
+    concatenates what comes back. Concurrent lookups do not wait for each
+    other, their requests queue up in the shards. Songs ingested afterwards
+    are sent to the shards that own their hashes.
+
+    The processes start on first use, and all of them again after one
+    stopped, in which case the songs ingested since the index was built
+    are missing until the next `flask buildindex`.
+    """
+
+    def __init__(self, path, shards, max_segments=INDEX_MAX_SEGMENTS) -> None:
+        self.path = path
+        self.shards = shards
+        self.max_segments = max_segments
+        self.loaded = False
+
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        self._running()
+
+    def close(self):
+        with self._lock:
+            for process in self._processes:
+                process.close()
+
+            self._processes = []
+            self.loaded = False
+
+    def add(self, song_id, hashes, offsets):
+        """Adds a song to the shards owning its hashes and waits for all of
+        them, raising the error of any that failed
+        """
+        processes = self._running()
+        shard_ids = shard_of(hashes, self.shards)
+
+        added = []
+        for shard, process in enumerate(processes):
+            rows = shard_ids == shard
+            if rows.any():
+                added.append(process.send(
+                    "add", (song_id, hashes[rows], offsets[rows]),
+                    reply=True))
+
+        for future in added:
+            future.result()
+
+    def get_postings_by_hashes(self, hashes):
+        """Returns the (hashes, song_ids, offsets) arrays stored for `hashes`"""
+        processes = self._running()
+
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+        shard_ids = shard_of(hashes, self.shards)
+
+        asked = []
+        for shard, process in enumerate(processes):
+            rows = shard_ids == shard
+            if rows.any():
+                asked.append(
+                    process.send("lookup", (hashes[rows],), reply=True))
+
+        found = [future.result() for future in asked]
+        found = [postings for postings in found if len(postings[0])]
+
+        if not found:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    def _running(self):
+        """Returns the shard processes, starting them when none runs or
+        one of them stopped
+        """
+        with self._lock:
+            if self.loaded and all(
+                    process.alive for process in self._processes):
+                return self._processes
+
+            if self.loaded:
+                logging.warning(
+                    "an index shard of %s stopped, restarting them; songs "
+                    "ingested since the index was built are missing until "
+                    "it is built again", self.path)
+
+                for process in self._processes:
+                    process.close()
+
+            # a forked child would inherit the parent's database connections
+            context = multiprocessing.get_context("spawn")
+
+            self._processes = [
+                _ShardProcess(context, shard_path(self.path, shard),
+                              self.max_segments)
+                for shard in range(self.shards)]
+            self.loaded = True
+
+            logging.info("started %d index shards from %s",
+                         self.shards, self.path)
+
+            return self._processes
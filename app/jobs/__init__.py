@@ -0,0 +1,15 @@
+from flask import current_app
+
+from .ingest import DONE, FAILED, QUEUED, RUNNING, IngestJobQueue
+
+
+def init_job_queue(app):
+    """Registers the background queue uploads are ingested by"""
+    app.extensions["ingest_jobs"] = IngestJobQueue(
+        app,
+        workers=app.config.get("INGEST_WORKERS", 2),
+        history=app.config.get("INGEST_JOB_HISTORY", 1000))
+
+
+def get_job_queue():
+    return current_app.extensions["ingest_jobs"]
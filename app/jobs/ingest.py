@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ..services import IngestService
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class IngestJobQueue:
+    """Runs uploads through IngestService on a pool of background threads.
+
+    Jobs live in process memory: the queue only remembers the last
+    `history` finished jobs and forgets everything on restart. Each job owns
+    the upload buffer it was given and closes it once it is done with it.
+    """
+
+    def __init__(self, app, workers=2, history=1000) -> None:
+        self.app = app
+        self.history = history
+
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fileobj, name, file_hash=None, profile=None):
+        """Queues the audio in `fileobj`, the upload of the file `name`, for
+        ingestion and returns the job id
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "state": QUEUED,
+            "filename": name,
+            "song_id": None,
+            "channels": None,
+            "channels_done": 0,
+            "seconds_decoded": 0.0,
+            "hashes_stored": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._forget_finished()
+
+        self._executor.submit(
+            self._run, job["id"], fileobj, name, file_hash, profile)
+
+        return job["id"]
+
+    def get(self, job_id):
+        """Returns a snapshot of the job, None when it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _update(self, job_id, changes):
+        with self._lock:
+            self._jobs[job_id].update(changes)
+
+    def _run(self, job_id, fileobj, name, file_hash, profile):
+        self._update(job_id, {"state": RUNNING, "started_at": time.time()})
+
+        try:
+            with self.app.app_context():
+                IngestService().ingest(
+                    name, profile=profile,
+                    progress=lambda changes: self._update(job_id, changes),
+                    fileobj=fileobj, file_hash=file_hash)
+
+            self._update(job_id, {"state": DONE})
+        except Exception as ex:
+            logging.exception("ingest job %s failed", job_id)
+            self._update(job_id, {"state": FAILED, "error": str(ex)})
+        finally:
+            self._update(job_id, {"finished_at": time.time()})
+            fileobj.close()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job["state"] in (DONE, FAILED)]
+
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
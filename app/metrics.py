@@ -0,0 +1,176 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Response
+
+# upper bounds, in seconds, of the stage duration histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+                 60.0, float("inf"))
+
+PREFIX = "audio_fingerprint"
+
+# stage totals of the GraphQL request being served, when it asked for them
+_request_stages = ContextVar("request_stages", default=None)
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics, stage) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Process wide stage timings and counters, in Prometheus text format.
+
+    Services wrap their stages in `metrics.time("stft")` or
+    `@metrics.timed("stft")` and bump counters with
+    `metrics.count("peaks", n)`; all of them do nothing but a flag check
+    while METRICS_ENABLED is off. `init_app` adds the /metrics route.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._stages = {}
+        self._counters = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", False)
+
+        if self.enabled:
+            app.add_url_rule("/metrics", "metrics", self.response)
+
+    def time(self, stage):
+        """Context manager adding its duration to the `stage` histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self, stage)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as `stage`"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with _Timer(self, stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = \
+                    [0.0, 0, [0] * len(STAGE_BUCKETS)]
+
+            histogram[0] += seconds
+            histogram[1] += 1
+            for position, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    histogram[2][position] += 1
+
+            # threads running a copy of the request's context share it
+            request_stages = _request_stages.get()
+            if request_stages is not None:
+                total, count = request_stages.get(stage, (0.0, 0))
+                request_stages[stage] = (total + seconds, count + 1)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register(self, name, collector):
+        """Adds a function returning {name: value} gauges read at scrape
+        time, e.g. the size of a cache, replacing any registered as `name`
+        """
+        self._collectors[name] = collector
+
+    @contextmanager
+    def collect_request(self):
+        """Gathers the {stage: (seconds, count)} totals of the stages run by
+        this thread inside the block in the dict it yields, along with
+        those of threads running copies of its context
+        (contextvars.copy_context)
+        """
+        request_stages = {}
+        token = _request_stages.set(request_stages)
+
+        try:
+            yield request_stages
+        finally:
+            _request_stages.reset(token)
+
+    def render(self):
+        lines = []
+
+        with self._lock:
+            stages = {stage: (total, count, list(buckets))
+                      for stage, (total, count, buckets)
+                      in self._stages.items()}
+            counters = dict(self._counters)
+
+        name = f"{PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} Time spent in each pipeline stage.")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, (total, count, buckets) in sorted(stages.items()):
+            for bound, bucket in zip(STAGE_BUCKETS, buckets):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'{name}_bucket{{stage="{stage}",le="{le}"}} {bucket}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        for counter, value in sorted(counters.items()):
+            name = f"{PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+
+        for collector in list(self._collectors.values()):
+            for gauge, value in sorted(collector().items()):
+                name = f"{PREFIX}_{gauge}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def response(self):
+        return Response(self.render(),
+                        content_type="text/plain; version=0.0.4")
+
+
+metrics = Metrics()
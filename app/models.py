@@ -37,6 +37,9 @@ class AuditColumns:
     @event.listens_for(db.mapper, "before_insert")
     @staticmethod
     def before_insert(mapper, connection, target):
+        if not isinstance(target, AuditColumns):
+            return
+
         username = getpass.getuser()
         target.created_at = datetime.utcnow()
         target.created_by = username
@@ -47,6 +50,9 @@ class AuditColumns:
     @event.listens_for(db.mapper, "before_update")
     @staticmethod
     def before_update(mapper, connection, target):
+        if not isinstance(target, AuditColumns):
+            return
+
         username = getpass.getuser()
         target.updated_at = datetime.utcnow()
         target.updated_by = username
@@ -55,13 +61,37 @@ class AuditColumns:
 class Song(db.Model, AuditColumns):
     name = db.Column(db.String(200), nullable=False)
     file_hash = db.Column(db.String(200), nullable=False)
+    # perfil de fingerprint (configs.fingerprint.FINGERPRINT_PROFILES)
+    profile = db.Column(db.String(32), nullable=False,
+                        default="native", server_default="native")
+    # modo de hash das fingerprints (configs.fingerprint.FINGERPRINT_HASH_MODE);
+    # as músicas anteriores à coluna usam "sha1"
+    hash_mode = db.Column(db.String(8), nullable=False,
+                          default="int", server_default="sha1")
 
     fingerprints = db.relationship(
         "Fingerprint", backref="song", lazy=True)
 
 
-class Fingerprint(db.Model, AuditColumns):
-    hash = db.Column(db.String(200), nullable=False)
+class Fingerprint(db.Model):
+    """Linha enxuta, sem colunas de auditoria: a tabela tem uma linha por hash"""
+
+    __tablename__ = "fingerprint"
+
+    hash = db.Column(db.BigInteger, nullable=False, index=True)
     offset = db.Column(db.Integer, nullable=False)
 
     song_id = db.Column(db.Integer, db.ForeignKey("song.id"), nullable=False)
+
+    # no surrogate key on disk; the ORM identifies a row by its contents
+    __mapper_args__ = {"primary_key": [song_id, offset, hash]}
+
+
+class StopHash(db.Model):
+    """Hash presente em músicas demais para distinguir alguma delas"""
+
+    __tablename__ = "stop_hash"
+
+    hash = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    # número de músicas com o hash quando a tabela foi recalculada
+    songs = db.Column(db.Integer, nullable=False)
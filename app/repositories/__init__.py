@@ -1,2 +1,3 @@
 from .fingerprint import FingerprintRepository
 from .song import SongRepository
+from .stop_hash import StopHashRepository
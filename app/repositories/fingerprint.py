@@ -1,7 +1,27 @@
+import io
+import logging
+import time
+from itertools import islice
 from typing import List
 
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from ..caches import get_bloom_filter, get_postings_cache
+from ..configs.fingerprint import (FINGERPRINT_FETCH_BATCH_SIZE,
+                                   FINGERPRINT_INSERT_BATCH_SIZE,
+                                   RECOGNITION_CACHED_POSTINGS)
+from ..metrics import metrics
 from ..models import Fingerprint, Song, db
 
+# scratch table the query hashes are joined through where there is no
+# array type; temporary, so every connection has its own
+_lookup_hashes = sa.Table(
+    "lookup_hash", sa.MetaData(),
+    sa.Column("hash", sa.BigInteger, primary_key=True),
+    prefixes=["TEMPORARY"])
+
 
 class FingerprintRepository:
     def __init__(self, db=db) -> None:
@@ -9,13 +29,9 @@ class FingerprintRepository:
 
     def upsert(self, fingerprint, song: Song):
         try:
-            fingerprint_db = self.get_by_id(
-                fingerprint.id) if hasattr(fingerprint, "id") else None
+            fingerprint_db = Fingerprint()
 
-            if not fingerprint_db:
-                fingerprint_db = Fingerprint()
-
-            fingerprint_db.hash = fingerprint["hash"]
+            fingerprint_db.hash = int(fingerprint["hash"])
             fingerprint_db.offset = int(fingerprint["offset"])
             fingerprint_db.song = song
 
@@ -28,37 +44,270 @@ class FingerprintRepository:
 
             return None
 
-    def upsert_bulk(self, fingerprints, song: Song):
+    def upsert_bulk(self, fingerprints, song: Song,
+                    batch_size=FINGERPRINT_INSERT_BATCH_SIZE) -> int:
+        """Stores the fingerprints of a song without building ORM objects.
+
+        Rows are written in batches of `batch_size`, each one in its own
+        transaction, through COPY when the driver is psycopg2 and through
+        multi-row Core inserts otherwise. The hashes are added to the Bloom
+        filter, which the caller saves. Returns the number of rows stored;
+        on failure the batches committed so far stay and the error is
+        raised.
+        """
+        postings_cache = get_postings_cache()
+        bloom_filter = get_bloom_filter()
+
+        stored = 0
         try:
-            fingerprints_db = []
+            started = time.perf_counter()
+            rows = ((int(fingerprint["hash"]), int(fingerprint["offset"]),
+                     song.id) for fingerprint in fingerprints)
+
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                with metrics.time("store"):
+                    if self.db.engine.dialect.driver == "psycopg2":
+                        self._copy_batch(batch)
+                    else:
+                        self._insert_batch(batch)
 
-            for fingerprint in fingerprints:
-                fingerprint_db = self.get_by_id(
-                    fingerprint.id) if hasattr(fingerprint, "id") else None
+                    self.db.session.commit()
+                stored += len(batch)
+                metrics.count("fingerprints_stored", len(batch))
 
-                if not fingerprint_db:
-                    fingerprint_db = Fingerprint()
+                hashes = np.array([row[0] for row in batch], dtype=np.int64)
+                if postings_cache is not None:
+                    postings_cache.invalidate(hashes)
+                if bloom_filter is not None:
+                    bloom_filter.add(hashes)
 
-                fingerprint_db.hash = fingerprint["hash"]
-                fingerprint_db.offset = int(fingerprint["offset"])
-                fingerprint_db.song = song
+            elapsed = time.perf_counter() - started
+            logging.info("stored %d fingerprints in %.2fs (%d rows/s)",
+                         stored, elapsed, stored / elapsed if elapsed else 0)
 
-                fingerprints_db.append(fingerprint_db)
-                self.db.session.add(fingerprint_db)
+            return stored
+        except Exception:
+            self.db.session.rollback()
+            logging.exception(
+                "could not store the fingerprints of song %d, %d rows were "
+                "stored already", song.id, stored)
+
+            raise
 
+    def delete_by_song(self, song: Song):
+        """Deletes every fingerprint of `song`, dropping their hashes from
+        the postings cache; returns the number of rows deleted
+        """
+        postings_cache = get_postings_cache()
+        table = Fingerprint.__table__
+
+        try:
+            hashes = np.array(self.db.session.execute(
+                self.db.select(table.c.hash)
+                .where(table.c.song_id == song.id)).scalars().all(),
+                dtype=np.int64)
+
+            deleted = self.db.session.execute(
+                table.delete().where(table.c.song_id == song.id)).rowcount
             self.db.session.commit()
 
-            return fingerprints_db
+            if postings_cache is not None:
+                postings_cache.invalidate(hashes)
+
+            return deleted
         except Exception as ex:
             self.db.session.rollback()
 
             return None
 
-    def get_by_id(self, id: int) -> Fingerprint:
-        return Fingerprint.query.filter_by(id=id).first()
+    def _insert_batch(self, batch):
+        self.db.session.execute(
+            Fingerprint.__table__.insert(),
+            [{"hash": hash, "offset": offset, "song_id": song_id}
+             for hash, offset, song_id in batch])
+
+    def _copy_batch(self, batch):
+        buffer = io.StringIO(
+            "".join("%d\t%d\t%d\n" % row for row in batch))
+
+        cursor = self.db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                'COPY fingerprint (hash, "offset", song_id) FROM STDIN', buffer)
+        finally:
+            cursor.close()
 
     def get_by_hash(self, hash) -> Fingerprint:
         return Fingerprint.query.filter_by(hash=hash).first()
 
     def get_all_by_hashes(self, hashes) -> List[Fingerprint]:
         return Fingerprint.query.filter(Fingerprint.hash.in_(hashes)).all()
+
+    def get_postings_by_hashes(self, hashes):
+        """Returns the (hashes, song_ids, offsets) arrays of every stored
+        fingerprint matching `hashes`, answering from the postings cache
+        what it can
+        """
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+        postings_cache = get_postings_cache()
+
+        if postings_cache is None:
+            return self._fetch_postings(hashes)
+
+        cached, missing, generation = postings_cache.lookup(hashes)
+        fetched = self._fetch_postings(missing)
+        postings_cache.store(missing, fetched, generation)
+
+        return tuple(np.concatenate(column)
+                     for column in zip(cached, fetched))
+
+    def get_candidate_postings(self, hashes, limit,
+                               max_cached=RECOGNITION_CACHED_POSTINGS):
+        """Returns the postings of `hashes`, as get_postings_by_hashes, of
+        the `limit` songs with most of them only.
+
+        The database counts the matches of every song and only the postings
+        of those songs are read. With a postings cache, the hashes with at
+        most `max_cached` postings are read whole and cached instead, and
+        once the cache holds every hash the songs are counted from it.
+        """
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+        postings_cache = get_postings_cache()
+
+        if postings_cache is None:
+            song_ids = self.get_candidate_songs(hashes, limit)
+            return self._fetch_postings(hashes, song_ids)
+
+        cached, missing, generation = postings_cache.lookup(hashes)
+
+        if not len(missing):
+            # most matches first, then lowest id, as get_candidate_songs
+            song_ids, hits = np.unique(cached[1], return_counts=True)
+            song_ids = song_ids[np.argsort(-hits, kind="stable")[:limit]]
+
+            keep = np.isin(cached[1], song_ids)
+            return tuple(column[keep] for column in cached)
+
+        song_ids = self.get_candidate_songs(hashes, limit)
+
+        counted, sizes = self._count_postings(missing)
+        large = counted[sizes > max_cached]
+        small = missing[~np.isin(missing, large)]
+
+        fetched = self._fetch_postings(small)
+        postings_cache.store(small, fetched, generation)
+
+        postings = [cached, fetched,
+                    self._fetch_postings(large, song_ids)]
+        postings = tuple(np.concatenate(column) for column in zip(*postings))
+
+        keep = np.isin(postings[1], song_ids)
+        return tuple(column[keep] for column in postings)
+
+    def get_candidate_songs(self, hashes, limit):
+        """Returns the ids of the `limit` songs with most stored
+        fingerprints matching `hashes`, most first, counted by the database
+        """
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+        if not len(hashes):
+            return np.empty(0, dtype=np.int64)
+
+        table = Fingerprint.__table__
+        hits = self.db.func.count().label("hits")
+        query = self.db.select(table.c.song_id, hits) \
+            .group_by(table.c.song_id) \
+            .order_by(hits.desc(), table.c.song_id) \
+            .limit(limit)
+
+        with metrics.time("db_candidates"):
+            rows = self.db.session.execute(
+                self._matching(query, hashes)).all()
+
+        return np.array([song_id for song_id, _ in rows], dtype=np.int64)
+
+    def _count_postings(self, hashes):
+        """Returns the stored hashes among `hashes` and the number of
+        postings of each, without reading them
+        """
+        if not len(hashes):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        table = Fingerprint.__table__
+        query = self.db.select(table.c.hash, self.db.func.count()) \
+            .group_by(table.c.hash)
+
+        with metrics.time("db_counts"):
+            rows = self.db.session.execute(
+                self._matching(query, hashes)).all()
+
+        columns = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        return columns[:, 0], columns[:, 1]
+
+    def _fetch_postings(self, hashes, song_ids=None):
+        """Reads the postings of all `hashes` with a single statement"""
+        table = Fingerprint.__table__
+        query = self.db.select(table.c.hash, table.c.song_id, table.c.offset)
+
+        if song_ids is not None:
+            query = query.where(
+                table.c.song_id.in_(np.asarray(song_ids).tolist()))
+
+        if not len(hashes):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        with metrics.time("db_lookup"):
+            rows = self.db.session.execute(
+                self._matching(query, hashes)).all()
+
+        columns = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        return columns[:, 0], columns[:, 1], columns[:, 2]
+
+    def _matching(self, query, hashes):
+        """Restricts a select over the fingerprint table to the rows of
+        `hashes`: they are bound as one array on PostgreSQL and joined
+        through a temporary table elsewhere
+        """
+        table = Fingerprint.__table__
+
+        if self.db.engine.dialect.name == "postgresql":
+            return query.where(table.c.hash == sa.any_(sa.bindparam(
+                "hashes", hashes.tolist(), type_=ARRAY(sa.BigInteger))))
+
+        connection = self.db.session.connection()
+        _lookup_hashes.create(connection, checkfirst=True)
+        connection.execute(_lookup_hashes.delete())
+        connection.execute(_lookup_hashes.insert(),
+                           [{"hash": hash} for hash in hashes.tolist()])
+
+        return query.join(_lookup_hashes,
+                          table.c.hash == _lookup_hashes.c.hash)
+
+    def count(self) -> int:
+        return self.db.session.query(self.db.func.count()).select_from(
+            Fingerprint.__table__).scalar()
+
+    def iter_postings(self, batch_size=FINGERPRINT_FETCH_BATCH_SIZE,
+                      ordered=False):
+        """Streams the whole table as (hashes, song_ids, offsets) arrays"""
+        table = Fingerprint.__table__
+        query = self.db.select(table.c.hash, table.c.song_id, table.c.offset)
+
+        if ordered:
+            query = query.order_by(table.c.hash)
+
+        result = self.db.session.execute(
+            query.execution_options(stream_results=True))
+
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+
+            columns = np.array(rows, dtype=np.int64)
+            yield columns[:, 0], columns[:, 1], columns[:, 2]
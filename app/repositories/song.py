@@ -1,3 +1,5 @@
+from ..configs.fingerprint import (DEFAULT_FINGERPRINT_PROFILE,
+                                   FINGERPRINT_HASH_MODE)
 from ..models import Song, db
 
 
@@ -14,6 +16,8 @@ class SongRepository:
 
             song_db.name = song["name"]
             song_db.file_hash = song["file_hash"]
+            song_db.profile = song.get("profile", DEFAULT_FINGERPRINT_PROFILE)
+            song_db.hash_mode = song.get("hash_mode", FINGERPRINT_HASH_MODE)
 
             self.db.session.add(song_db)
             self.db.session.commit()
@@ -24,8 +28,29 @@ class SongRepository:
 
             return None
 
+    def delete(self, song):
+        try:
+            self.db.session.delete(song)
+            self.db.session.commit()
+
+            return song
+        except Exception as ex:
+            self.db.session.rollback()
+
+            return None
+
     def get_by_id(self, id: int) -> Song:
         return Song.query.filter_by(id=id).first()
 
     def get_by_file_hash(self, file_hash: str) -> Song:
         return Song.query.filter_by(file_hash=file_hash).first()
+
+    def get_profiles(self, profile=None):
+        """(profile, hash mode) pairs the stored songs were fingerprinted
+        with, only those of `profile` when given
+        """
+        query = self.db.session.query(Song.profile, Song.hash_mode).distinct()
+        if profile is not None:
+            query = query.filter(Song.profile == profile)
+
+        return [(profile, hash_mode) for profile, hash_mode in query]
@@ -0,0 +1,46 @@
+import logging
+
+import numpy as np
+
+from ..models import Fingerprint, StopHash, db
+
+
+class StopHashRepository:
+    def __init__(self, db=db) -> None:
+        self.db = db
+
+    def get_hashes(self):
+        """Sorted int64 array of every stop hash"""
+        table = StopHash.__table__
+        rows = self.db.session.execute(
+            self.db.select(table.c.hash).order_by(table.c.hash)).all()
+
+        return np.array([hash for hash, in rows], dtype=np.int64)
+
+    def rebuild(self, min_songs):
+        """Replaces the table with the document frequency of every hash
+        stored in at least `min_songs` songs; returns how many there are
+        """
+        fingerprints = Fingerprint.__table__
+        table = StopHash.__table__
+        songs = self.db.func.count(fingerprints.c.song_id.distinct())
+
+        try:
+            self.db.session.execute(table.delete())
+            self.db.session.execute(table.insert().from_select(
+                ["hash", "songs"],
+                self.db.select(fingerprints.c.hash, songs)
+                .group_by(fingerprints.c.hash)
+                .having(songs >= min_songs)))
+            self.db.session.commit()
+
+            return self.count()
+        except Exception as ex:
+            self.db.session.rollback()
+            logging.exception("could not rebuild the stop hashes")
+
+            return None
+
+    def count(self) -> int:
+        return self.db.session.query(self.db.func.count()).select_from(
+            StopHash.__table__).scalar()
@@ -1,3 +1,4 @@
 from .audio import AudioService
 from .fingerprint import FingerprintService
 from .song import SongService
+from .ingest import IngestService
@@ -1,17 +1,40 @@
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
 from hashlib import sha1
+from math import gcd
 
 import numpy as np
 from pydub import AudioSegment
 from pydub.utils import audioop
+from scipy.signal import resample_poly
+
+from ..configs.fingerprint import AUDIO_CHUNK_SECONDS, UPLOAD_SPOOL_MAX_SIZE
+from ..metrics import metrics
+from ..uploads import UploadFile
 
 
 class AudioService:
-    def parse_audio(self, filename):
+    @metrics.timed("decode")
+    def parse_audio(self, filename, fileobj=None, file_hash=None):
+        """ Decodes `filename`, or the bytes of `fileobj` when given, in
+        which case `filename` only names the audio and `file_hash` should
+        come along with it (see spool).
+        """
         limit = None
         # limit = 10
 
         try:
-            audiofile = AudioSegment.from_file(filename)
+            if fileobj:
+                audiofile = AudioSegment.from_file(
+                    fileobj, format=self._format(filename))
+            else:
+                audiofile = AudioSegment.from_file(filename)
 
             if limit:
                 audiofile = audiofile[:limit * 1000]
@@ -24,7 +47,7 @@ class AudioService:
 
             fs = audiofile.frame_rate
         except audioop.error:
-            print('audioop.error')
+            logging.error('audioop.error')
         pass
         # fs, _, audiofile = wavio.readwav(filename)
 
@@ -42,9 +65,140 @@ class AudioService:
             "filemname": filename,
             "channels": channels,
             "Fs": audiofile.frame_rate,
-            "file_hash": self.parse_file_hash(filename)
+            "file_hash": file_hash or self.parse_file_hash(filename)
         }
 
+    def stream_audio(self, filename, chunk_seconds=AUDIO_CHUNK_SECONDS,
+                     file_hash=None, fileobj=None):
+        """ Same as parse_audio, but "channels" is replaced by "chunks", a
+        generator of per channel sample arrays holding `chunk_seconds` of
+        audio each, so the whole file is never held in memory.
+
+        WAV files are read directly; anything else is decoded to WAV by
+        ffmpeg (the converter pydub uses) and read from its stdout, with
+        `fileobj`, when given, written to its stdin.
+        """
+        if self._format(filename) == "wav":
+            process = None
+            audiofile = wave.open(fileobj or filename, "rb")
+        else:
+            process = subprocess.Popen(
+                [AudioSegment.converter, "-v", "error",
+                 "-i", "pipe:0" if fileobj else filename,
+                 "-vn", "-f", "wav", "-acodec", "pcm_s16le", "-"],
+                stdin=subprocess.PIPE if fileobj else subprocess.DEVNULL,
+                stdout=subprocess.PIPE)
+
+            if fileobj:
+                threading.Thread(target=self._feed,
+                                 args=(fileobj, process.stdin),
+                                 daemon=True).start()
+
+            audiofile = wave.open(process.stdout, "rb")
+
+        if audiofile.getsampwidth() != 2:
+            audiofile.close()
+            raise ValueError("only 16-bit PCM WAV files can be streamed")
+
+        channels = audiofile.getnchannels()
+        fs = audiofile.getframerate()
+
+        def chunks():
+            try:
+                while True:
+                    with metrics.time("decode"):
+                        data = audiofile.readframes(int(chunk_seconds * fs))
+                    if not data:
+                        break
+
+                    data = np.frombuffer(data, np.int16)
+                    yield [data[chn::channels] for chn in range(channels)]
+            finally:
+                audiofile.close()
+                if process:
+                    process.stdout.close()
+                    process.wait()
+
+        return {
+            "filemname": filename,
+            "channels": channels,
+            "chunks": chunks(),
+            "Fs": fs,
+            "file_hash": file_hash or self.parse_file_hash(filename)
+        }
+
+    def spool(self, upload, max_size=UPLOAD_SPOOL_MAX_SIZE, blocksize=2**20):
+        """ Returns the bytes of `upload`, a werkzeug FileStorage, in a
+        rewound buffer the caller closes, with their hash, the same
+        parse_file_hash gives for the file.
+
+        Uploads of an UploadRequest were spooled and hashed as they arrived,
+        so their buffer is handed over as is and the request no longer
+        closes it; other streams are copied into a buffer kept in memory up
+        to `max_size` bytes, hashing them on the way.
+        """
+        stream = upload.stream
+
+        if isinstance(stream, UploadFile):
+            upload.stream = io.BytesIO()
+            stream.seek(0)
+
+            return stream, stream.file_hash
+
+        s = sha1()
+        spooled = tempfile.SpooledTemporaryFile(max_size)
+
+        while True:
+            buf = stream.read(blocksize)
+            if not buf:
+                break
+            s.update(buf)
+            spooled.write(buf)
+
+        spooled.seek(0)
+
+        return spooled, s.hexdigest().upper()
+
+    @staticmethod
+    def _feed(fileobj, pipe):
+        try:
+            shutil.copyfileobj(fileobj, pipe)
+        except BrokenPipeError:
+            # the decoder gave up on the file; its exit status tells why
+            pass
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+    @staticmethod
+    def _format(filename):
+        """Format handed to the decoder; only WAV skips ffmpeg's probing"""
+        extension = os.path.splitext(filename)[1].lower()
+
+        return "wav" if extension in (".wav", ".wave") else None
+
+    def conform(self, channels, Fs, profile):
+        """Prepares channel samples for a fingerprint profile: downmixes them
+        to a single channel and resamples them to the profile's rate when it
+        asks for it. Returns the (channels, Fs) to fingerprint.
+
+        Chunks are resampled independently; the few samples at each edge
+        this distorts are far below what moves a spectrogram peak.
+        """
+        if profile['mono'] and len(channels) > 1:
+            channels = [np.mean(channels, axis=0, dtype=np.float32)]
+
+        fs = profile['fs']
+        if not fs or fs == Fs:
+            return channels, Fs
+
+        divisor = gcd(fs, Fs)
+        return [resample_poly(channel.astype(np.float32),
+                              fs // divisor, Fs // divisor)
+                for channel in channels], fs
+
     def parse_file_hash(self, filename, blocksize=2**20):
         """ Small function to generate a hash to uniquely generate
         a file. Inspired by MD5 version here:
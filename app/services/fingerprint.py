@@ -1,32 +1,66 @@
 import hashlib
-from operator import itemgetter
+import logging
 
-import matplotlib.mlab as mlab
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.ndimage.filters import maximum_filter
-from scipy.ndimage.morphology import (binary_erosion,
-                                      generate_binary_structure,
-                                      iterate_structure)
+from scipy.ndimage import maximum_filter1d
 
 from ..configs.fingerprint import (DEFAULT_AMP_MIN, DEFAULT_FAN_VALUE,
-                                   DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
-                                   DEFAULT_WINDOW_SIZE, FINGERPRINT_REDUCTION,
-                                   IDX_FREQ_I, IDX_TIME_J, MAX_HASH_TIME_DELTA,
-                                   MIN_HASH_TIME_DELTA, PEAK_NEIGHBORHOOD_SIZE,
+                                   DEFAULT_FINGERPRINT_PROFILE, DEFAULT_FS,
+                                   DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE,
+                                   FINGERPRINT_HASH_MODE,
+                                   FINGERPRINT_HASH_MODES, FINGERPRINT_PROFILES,
+                                   FINGERPRINT_REDUCTION, HASH_DELTA_BITS,
+                                   HASH_FREQ_BITS, IDX_FREQ_I, IDX_TIME_J,
+                                   MIN_HASH_TIME_DELTA, PEAK_FILTER_SHAPE,
                                    PEAK_SORT)
+from ..metrics import metrics
+from .spectrogram import SpectrogramService
 
 
 class FingerprintService:
+    def __init__(self, profile=DEFAULT_FINGERPRINT_PROFILE,
+                 hash_mode=FINGERPRINT_HASH_MODE) -> None:
+        if profile not in FINGERPRINT_PROFILES:
+            raise ValueError("unknown fingerprint profile %r" % profile)
+        if hash_mode not in FINGERPRINT_HASH_MODES:
+            raise ValueError("unknown fingerprint hash mode %r" % hash_mode)
+
+        self.spectrogram_service = SpectrogramService()
+
+        self.profile_name = profile
+        self.profile = FINGERPRINT_PROFILES[profile]
+        self.hash_mode = hash_mode
+
+    @property
+    def signature(self):
+        """Digest of every setting that changes the hashes of a file"""
+        settings = (
+            sorted(self.profile.items()), PEAK_FILTER_SHAPE, PEAK_SORT,
+            MIN_HASH_TIME_DELTA, self.hash_mode,
+            FINGERPRINT_REDUCTION, HASH_FREQ_BITS, HASH_DELTA_BITS)
+
+        return hashlib.sha1(repr(settings).encode()).hexdigest()[:16]
+
     def fingerprint(self, channel_samples, Fs=DEFAULT_FS,
-                    wsize=DEFAULT_WINDOW_SIZE,
-                    wratio=DEFAULT_OVERLAP_RATIO,
-                    fan_value=DEFAULT_FAN_VALUE,
-                    amp_min=DEFAULT_AMP_MIN,
+                    wsize=None,
+                    wratio=None,
+                    fan_value=None,
+                    amp_min=None,
                     plots=False):
+        """Fingerprints samples already prepared for the profile (see
+        AudioService.conform); wsize, wratio, fan_value and amp_min default
+        to the profile's
+        """
+        wsize = wsize or self.profile['wsize']
+        wratio = wratio or self.profile['wratio']
+        fan_value = fan_value or self.profile['fan_value']
+        if amp_min is None:
+            amp_min = self.profile['amp_min']
 
         # show samples plot
         if plots:
+            import matplotlib.pyplot as plt
+
             plt.plot(channel_samples)
             plt.title('%d samples' % len(channel_samples))
             plt.xlabel('time (s)')
@@ -38,13 +72,8 @@ class FingerprintService:
         # locally sensitive hashes.
         # FFT the signal and extract frequency components
 
-        # plot the angle spectrum of segments within the signal in a colormap
-        arr2D = mlab.specgram(
-            channel_samples,
-            NFFT=wsize,
-            Fs=Fs,
-            window=mlab.window_hanning,
-            noverlap=int(wsize * wratio))[0]
+        arr2D = self._spectrogram(channel_samples, Fs=Fs, wsize=wsize,
+                                  wratio=wratio)
 
         # show spectrogram plot
         if plots:
@@ -52,53 +81,86 @@ class FingerprintService:
             plt.title('FFT')
             plt.show()
 
-        # apply log transform since specgram() returns linear array
-        # calculates the base 10 logarithm for all elements of arr2D
-        np.seterr(divide='ignore')
-        arr2D = 10 * np.log10(arr2D)
-        np.seterr(divide='warn')
-        
-        arr2D[arr2D == -np.inf] = 0  # replace infs with zeros
-
         # find local maxima
         local_maxima = self._get_2D_peaks(arr2D, plot=plots, amp_min=amp_min)
 
+        # keep the strongest of them within the profile's budget
+        budget = self._peak_budget(Fs, wsize, wratio, fan_value)
+        if budget is not None:
+            local_maxima = self._strongest_peaks(
+                local_maxima, arr2D[local_maxima[:, IDX_FREQ_I],
+                                    local_maxima[:, IDX_TIME_J]], *budget)
+
         msg = '   local_maxima: %d of frequency & time pairs'
-        print(msg % len(local_maxima))
+        logging.debug(msg, len(local_maxima))
 
         # return hashes
         return self._generate_hashes(local_maxima, fan_value=fan_value)
 
-    def _get_2D_peaks(self, arr2D, plot=False, amp_min=DEFAULT_AMP_MIN):
-        # http://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.morphology.iterate_structure.html#scipy.ndimage.morphology.iterate_structure
-        struct = generate_binary_structure(2, 1)
-        neighborhood = iterate_structure(struct, PEAK_NEIGHBORHOOD_SIZE)
+    def stream(self, Fs=DEFAULT_FS,
+               wsize=None,
+               wratio=None,
+               fan_value=None,
+               amp_min=None):
+        """Returns a FingerprintStream fingerprinting one channel piece by
+        piece with the same results as `fingerprint` on the whole channel
+        """
+        return FingerprintStream(
+            self, Fs=Fs,
+            wsize=wsize or self.profile['wsize'],
+            wratio=wratio or self.profile['wratio'],
+            fan_value=fan_value or self.profile['fan_value'],
+            amp_min=self.profile['amp_min'] if amp_min is None else amp_min)
 
-        # find local maxima using our fliter shape
-        local_max = maximum_filter(arr2D, footprint=neighborhood) == arr2D
-        background = (arr2D == 0)
-        eroded_background = binary_erosion(background, structure=neighborhood,
-                                           border_value=1)
+    def seconds(self, offset, Fs=DEFAULT_FS):
+        """Converts a frame offset of this profile to seconds; Fs is the
+        rate of the audio before AudioService.conform
+        """
+        wsize = self.profile['wsize']
+        hop = wsize - int(wsize * self.profile['wratio'])
+
+        return round(float(offset) * hop / (self.profile['fs'] or Fs), 5)
 
-        # Boolean mask of arr2D with True at peaks
-        detected_peaks = local_max ^ eroded_background
+    @metrics.timed("stft")
+    def _spectrogram(self, channel_samples, Fs=DEFAULT_FS,
+                     wsize=DEFAULT_WINDOW_SIZE,
+                     wratio=DEFAULT_OVERLAP_RATIO):
+        # log transformed power spectrum of overlapping windows of the signal
+        return self.spectrogram_service.spectrogram(
+            channel_samples, Fs=Fs, wsize=wsize, wratio=wratio)
 
-        # extract peaks
-        amps = arr2D[detected_peaks]
-        j, i = np.where(detected_peaks)
+    @metrics.timed("peaks")
+    def _get_2D_peaks(self, arr2D, plot=False, amp_min=None,
+                      shape=PEAK_FILTER_SHAPE):
+        """Returns an (n, 2) array of peaks, with the frequency and time
+        indexes in the IDX_FREQ_I and IDX_TIME_J columns
+        """
+        neighborhood = self.profile['neighborhood']
+        if amp_min is None:
+            amp_min = self.profile['amp_min']
 
-        # filter peaks
-        amps = amps.flatten()
-        peaks = zip(i, j, amps)
-        peaks_filtered = [x for x in peaks if x[2]
-                          > amp_min]  # freq, time, amp
+        # find local maxima using our filter shape
+        local_max = self._sliding_max(arr2D, neighborhood, shape) == arr2D
+
+        # cells whose whole neighbourhood is 0 (silence) are not peaks;
+        # real spectrograms rarely have any 0 at all
+        background = (arr2D == 0)
+        if background.any():
+            eroded_background = ~self._sliding_max(
+                ~background, neighborhood, shape)
+            local_max ^= eroded_background
+
+        # Boolean mask of arr2D with True at strong enough peaks
+        detected_peaks = local_max
+        detected_peaks &= arr2D > amp_min
 
         # get indices for frequency and time
-        frequency_idx = [x[1] for x in peaks_filtered]
-        time_idx = [x[0] for x in peaks_filtered]
+        frequency_idx, time_idx = np.nonzero(detected_peaks)
 
         # scatter of the peaks
         if plot:
+            import matplotlib.pyplot as plt
+
             fig, ax = plt.subplots()
             ax.imshow(arr2D)
             ax.scatter(time_idx, frequency_idx)
@@ -108,33 +170,258 @@ class FingerprintService:
             plt.gca().invert_yaxis()
             plt.show()
 
-        return list(zip(frequency_idx, time_idx))
+        peaks = np.empty((len(frequency_idx), 2), dtype=np.int64)
+        peaks[:, IDX_FREQ_I] = frequency_idx
+        peaks[:, IDX_TIME_J] = time_idx
+
+        metrics.count("peaks", len(peaks))
+        return peaks
+
+    def _peak_budget(self, Fs, wsize, wratio, fan_value):
+        """Returns (peaks, frames): at most `peaks` peaks are kept in every
+        slice of `frames` spectrogram frames, about a second, so that
+        neither the profile's peaks_per_second nor, as a peak anchors at
+        most fan_value - 1 hashes, its hashes_per_second is exceeded; None
+        when the profile sets neither
+        """
+        per_second = [self.profile['peaks_per_second']]
+        if self.profile['hashes_per_second']:
+            per_second.append(
+                self.profile['hashes_per_second'] / max(fan_value - 1, 1))
+
+        per_second = [rate for rate in per_second if rate]
+        if not per_second:
+            return None
+
+        hop = wsize - int(wsize * wratio)
+        frames = max(int(round(Fs / hop)), 1)
+
+        return max(int(min(per_second) * frames * hop / Fs), 1), frames
+
+    @staticmethod
+    def _strongest_peaks(peaks, amplitudes, budget, frames):
+        """Keeps the `budget` peaks of highest amplitude of every slice of
+        `frames` frames, counted from frame 0; ties go to the earliest and
+        then lowest peak, so slices give the same peaks however the
+        spectrogram was cut
+        """
+        times = peaks[:, IDX_TIME_J]
+        slices = times // frames
+
+        order = np.lexsort(
+            (peaks[:, IDX_FREQ_I], times, -amplitudes, slices))
+        slices = slices[order]
+        rank = np.arange(len(order)) - np.searchsorted(slices, slices)
+
+        return peaks[np.sort(order[rank < budget])]
+
+    @staticmethod
+    def _sliding_max(arr2D, radius, shape=PEAK_FILTER_SHAPE):
+        """Maximum of every cell's neighbourhood of `radius` cells.
+
+        "diamond" gives exactly maximum_filter with the footprint
+        iterate_structure(generate_binary_structure(2, 1), radius), built
+        as `radius` dilations by the 3x3 cross, each of them four shifted
+        np.maximum calls. "rectangle" uses the (2 * radius + 1) square
+        instead, in two separable passes: faster, but twice the area of
+        the diamond, so it finds fewer peaks.
+        """
+        if shape == "rectangle":
+            size = 2 * radius + 1
+            return maximum_filter1d(
+                maximum_filter1d(arr2D, size, axis=0), size, axis=1)
+
+        result = arr2D.copy()
+        previous = np.empty_like(result)
+
+        for _ in range(radius):
+            previous[...] = result
+
+            np.maximum(result[1:], previous[:-1], out=result[1:])
+            np.maximum(result[:-1], previous[1:], out=result[:-1])
+            np.maximum(result[:, 1:], previous[:, :-1], out=result[:, 1:])
+            np.maximum(result[:, :-1], previous[:, 1:], out=result[:, :-1])
+
+        return result
+
+    # Hash list structure: (hashes, offsets) int64 arrays
+    # example: (array([4295032838, ...]), array([32, ...]))
+    # with the "sha1" hash mode hashes are int(sha1_hash[0:15], 16)
+
+    @metrics.timed("hashing")
+    def _generate_hashes(self, peaks, fan_value=None, hash_mode=None):
+        profile_id = self.profile['id']
+        hash_mode = hash_mode or self.hash_mode
+        fan_value = fan_value or self.profile['fan_value']
 
-    # Hash list structure: sha1_hash[0:20] time_offset
-    # example: [(e05b341a9b77a51fd26, 32), ... ]
+        peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
 
-    def _generate_hashes(self, peaks, fan_value=DEFAULT_FAN_VALUE):
         if PEAK_SORT:
-            peaks = sorted(peaks, key=itemgetter(1))
+            peaks = peaks[np.argsort(peaks[:, IDX_TIME_J], kind="stable")]
+
+        freqs = peaks[:, IDX_FREQ_I]
+        times = peaks[:, IDX_TIME_J]
+
+        # pair every peak with its next fan_value - 1 neighbours at once:
+        # row i holds the indexes of the peaks paired with peak i
+        anchors = np.arange(len(peaks))
+        neighbours = anchors[:, None] + np.arange(1, max(fan_value, 1))[None, :]
+        in_range = neighbours < len(peaks)
+
+        anchors = np.broadcast_to(anchors[:, None], neighbours.shape)[in_range]
+        neighbours = neighbours[in_range]
+
+        freq1 = freqs[anchors]
+        freq2 = freqs[neighbours]
+        t1 = times[anchors]
+        t_delta = times[neighbours] - t1
+
+        # check if delta is between min & max
+        valid = (t_delta >= MIN_HASH_TIME_DELTA) & \
+            (t_delta <= self.profile['max_delta'])
+        freq1, freq2, t_delta, t1 = \
+            freq1[valid], freq2[valid], t_delta[valid], t1[valid]
+
+        if hash_mode == "sha1":
+            # the profile only salts the digest when it is not the original
+            salt = f"{profile_id}|" if profile_id else ""
+            hashes = np.array([
+                int(hashlib.sha1(f"{salt}{f1}|{f2}|{dt}".encode())
+                    .hexdigest()[0:FINGERPRINT_REDUCTION], 16)
+                for f1, f2, dt in zip(freq1.tolist(), freq2.tolist(),
+                                      t_delta.tolist())
+            ], dtype=np.int64)
+        else:
+            hashes = (profile_id << (2 * HASH_FREQ_BITS + HASH_DELTA_BITS)) \
+                | (freq1 << (HASH_FREQ_BITS + HASH_DELTA_BITS)) \
+                | (freq2 << HASH_DELTA_BITS) \
+                | t_delta
+
+        metrics.count("hashes", len(hashes))
+        return hashes, t1
+
+
+class FingerprintStream:
+    """Fingerprints a channel fed in consecutive pieces.
+
+    Spectrogram frames keep their position in the whole channel, and a peak
+    is only accepted once the profile's neighborhood of frames on both
+    sides of it has been computed, so it sees the same neighbourhood as in a
+    single pass; with a peak budget, only once its whole slice has.
+    Likewise a peak is only hashed once every peak it can be paired
+    with is known. Each `feed` returns the
+    (hashes, offsets) that became final; `close` returns the rest.
+    """
+
+    def __init__(self, fingerprint_service, Fs=DEFAULT_FS,
+                 wsize=DEFAULT_WINDOW_SIZE,
+                 wratio=DEFAULT_OVERLAP_RATIO,
+                 fan_value=DEFAULT_FAN_VALUE,
+                 amp_min=DEFAULT_AMP_MIN) -> None:
+        self.service = fingerprint_service
+        self.Fs = Fs
+        self.wsize = wsize
+        self.wratio = wratio
+        self.fan_value = fan_value
+        self.amp_min = amp_min
+
+        self.hop = wsize - int(wsize * wratio)
+        self.neighborhood = fingerprint_service.profile['neighborhood']
+        self.max_delta = fingerprint_service.profile['max_delta']
+
+        # a budget ranks the peaks of a whole slice at once
+        self.budget = fingerprint_service._peak_budget(
+            Fs, wsize, wratio, fan_value)
+
+        # samples not yet part of a frame, starting at frame self._frames
+        self._samples = np.empty(0, dtype=np.int16)
+        self._frames = 0
+
+        # spectrogram columns kept around for peak picking
+        self._arr2D = None
+        self._arr2D_start = 0
+
+        # peaks of frames before self._peaks_until are final
+        self._peaks = np.empty((0, 2), dtype=np.int64)
+        self._peaks_until = 0
+
+    def feed(self, channel_samples):
+        samples = np.concatenate([self._samples, channel_samples])
+        frames = 0
+        if len(samples) >= self.wsize:
+            frames = (len(samples) - self.wsize) // self.hop + 1
+
+        if frames:
+            arr2D = self.service._spectrogram(
+                samples[:(frames - 1) * self.hop + self.wsize], Fs=self.Fs,
+                wsize=self.wsize, wratio=self.wratio)
+
+            if self._arr2D is None:
+                self._arr2D = arr2D
+            else:
+                self._arr2D = np.concatenate([self._arr2D, arr2D], axis=1)
+
+            self._samples = samples[frames * self.hop:]
+            self._frames += frames
+        else:
+            self._samples = samples
+
+        peaks_until = self._frames - self.neighborhood
+        if self.budget is not None:
+            peaks_until -= peaks_until % self.budget[1]
+
+        return self._advance(peaks_until)
+
+    def close(self):
+        return self._advance(self._frames, final=True)
+
+    def _advance(self, peaks_until, final=False):
+        if self._arr2D is not None and peaks_until > self._peaks_until:
+            peaks = self.service._get_2D_peaks(self._arr2D, amp_min=self.amp_min)
+            amplitudes = self._arr2D[peaks[:, IDX_FREQ_I], peaks[:, IDX_TIME_J]]
+            peaks[:, IDX_TIME_J] += self._arr2D_start
+
+            times = peaks[:, IDX_TIME_J]
+            new = (times >= self._peaks_until) & (times < peaks_until)
+            peaks = peaks[new]
+
+            if self.budget is not None:
+                peaks = self.service._strongest_peaks(
+                    peaks, amplitudes[new], *self.budget)
+            self._peaks = np.concatenate([self._peaks, peaks])
+            self._peaks_until = peaks_until
+
+            # keep only the columns the next frames' peaks depend on
+            keep_from = max(peaks_until - self.neighborhood,
+                            self._arr2D_start)
+            self._arr2D = self._arr2D[:, keep_from - self._arr2D_start:]
+            self._arr2D_start = keep_from
+
+        # peaks are hashed in time order, frequency breaking ties
+        self._peaks = self._peaks[np.lexsort(
+            (self._peaks[:, IDX_FREQ_I], self._peaks[:, IDX_TIME_J]))]
+
+        hashes, offsets = self.service._generate_hashes(
+            self._peaks, fan_value=self.fan_value)
 
-        # bruteforce all peaks
-        for i in range(len(peaks)):
-            for j in range(1, fan_value):
-                if (i + j) < len(peaks):
+        if final:
+            self._peaks = self._peaks[:0]
+            return hashes, offsets
 
-                    # take current & next peak frequency value
-                    freq1 = peaks[i][IDX_FREQ_I]
-                    freq2 = peaks[i + j][IDX_FREQ_I]
+        # a peak's hashes are final once the fan_value - 1 peaks after it or
+        # every peak up to max_delta frames later are known; as
+        # offsets of one frame can be split, cut at the first incomplete one
+        times = self._peaks[:, IDX_TIME_J]
+        complete = max(
+            len(times) - self.fan_value + 1,
+            np.searchsorted(times, self._peaks_until - self.max_delta))
 
-                    # take current & next -peak time offset
-                    t1 = peaks[i][IDX_TIME_J]
-                    t2 = peaks[i + j][IDX_TIME_J]
+        if complete < len(times):
+            hash_until = times[complete]
+        else:
+            hash_until = self._peaks_until
 
-                    # get diff of time offsets
-                    t_delta = t2 - t1
+        done = offsets < hash_until
+        self._peaks = self._peaks[times >= hash_until]
 
-                    # check if delta is between min & max
-                    if t_delta >= MIN_HASH_TIME_DELTA and t_delta <= MAX_HASH_TIME_DELTA:
-                        h = hashlib.sha1(
-                            f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode())
-                        yield (h.hexdigest()[0:FINGERPRINT_REDUCTION], t1)
+        return hashes[done], offsets[done]
@@ -0,0 +1,369 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+import numpy as np
+from flask import current_app
+
+from ..configs.fingerprint import (AUDIO_FILE_EXTENSIONS,
+                                   DEFAULT_FINGERPRINT_PROFILE,
+                                   FINGERPRINT_CACHE_MAX_HASHES,
+                                   FINGERPRINT_INSERT_BATCH_SIZE,
+                                   FINGERPRINT_PROFILES)
+from ..caches import get_bloom_filter, get_fingerprint_cache
+from ..filters import get_stop_hashes
+from ..indexes import get_fingerprint_index
+from ..metrics import metrics
+from ..repositories import FingerprintRepository, SongRepository
+from .audio import AudioService
+from .fingerprint import FingerprintService
+
+
+class IngestService:
+    """Fingerprints a song and stores it while it is being decoded.
+
+    Audio is decoded in chunks, each channel is fed to its own
+    FingerprintStream and the hashes are flushed to the repository every
+    `batch_size` rows, so memory stays flat however long the file is.
+    """
+
+    def __init__(self, batch_size=FINGERPRINT_INSERT_BATCH_SIZE) -> None:
+        self.audio_service = AudioService()
+        self.song_repo = SongRepository()
+        self.fingerprint_repo = FingerprintRepository()
+        self.fingerprint_index = get_fingerprint_index()
+        self.fingerprint_cache = get_fingerprint_cache()
+        self.stop_hashes = get_stop_hashes()
+        self.bloom_filter = get_bloom_filter()
+
+        self.batch_size = batch_size
+
+    @metrics.timed("ingest")
+    def ingest(self, filename, name=None, profile=None, progress=None,
+               fileobj=None, file_hash=None):
+        """Stores `filename` fingerprinted with `profile`, unless a song with
+        the same file hash is stored already. The audio is read from
+        `fileobj` instead when given (see AudioService.spool).
+
+        `progress`, when given, is called with a dict of the counters that
+        changed (song_id, channels, channels_done, seconds_decoded,
+        hashes_stored) as the file goes through.
+        """
+        progress = progress or (lambda changes: None)
+
+        profile = self._profile(profile)
+
+        file_hash = file_hash or self.audio_service.parse_file_hash(filename)
+
+        song = self.song_repo.get_by_file_hash(file_hash)
+
+        if song:
+            msg = '   already stored as song %d, skipping'
+            logging.info(msg, song.id)
+
+            progress({'song_id': song.id})
+            return song
+
+        song = self.song_repo.upsert(
+            {
+                'name': name or filename,
+                'file_hash': file_hash,
+                'profile': profile
+            }
+        )
+        progress({'song_id': song.id})
+
+        try:
+            self._fingerprint_song(song, filename, profile, progress, fileobj)
+        except Exception:
+            # uploading the file again then ingests it anew
+            self._discard(song)
+            progress({'song_id': None, 'hashes_stored': 0})
+            raise
+
+        return song
+
+    def _fingerprint_song(self, song, filename, profile, progress, fileobj):
+        file_hash = song.file_hash
+        fingerprint_service = FingerprintService(profile)
+        profile = FINGERPRINT_PROFILES[profile]
+
+        # a file recognized before has had every channel fingerprinted
+        if self.fingerprint_cache is not None:
+            cached = self.fingerprint_cache.get(
+                file_hash, fingerprint_service.signature)
+
+            if cached:
+                channels = len(cached['fingerprints'])
+                stored = self._flush(cached['fingerprints'], song)
+
+                self._save_bloom_filter()
+
+                msg = '   stored %d unique hashes from the fingerprint cache'
+                logging.info(msg, stored)
+
+                progress({'channels': channels, 'channels_done': channels,
+                          'hashes_stored': stored})
+                return
+
+        audio = self.audio_service.stream_audio(
+            filename, file_hash=file_hash, fileobj=fileobj)
+
+        channels = 1 if profile['mono'] else audio['channels']
+        streams = [fingerprint_service.stream(Fs=profile['fs'] or audio['Fs'])
+                   for _ in range(channels)]
+        progress({'channels': channels})
+
+        # the hashes of every channel, kept only to fill the cache
+        fingerprints = None
+        if self.fingerprint_cache is not None:
+            fingerprints = [[] for _ in streams]
+
+        pending = []
+        stored = 0
+        decoded = 0
+
+        for chunk in audio['chunks']:
+            decoded += len(chunk[0])
+            chunk, _ = self.audio_service.conform(chunk, audio['Fs'], profile)
+            parts = [stream.feed(channel)
+                     for stream, channel in zip(streams, chunk)]
+            pending.extend(parts)
+            fingerprints = self._keep_for_cache(fingerprints, parts)
+
+            # every channel has seen as many frames, so a hash repeated
+            # across channels always lands in the same flush
+            if sum(len(hashes) for hashes, _ in pending) >= self.batch_size:
+                stored += self._flush(pending, song)
+                pending = []
+
+            progress({'seconds_decoded': decoded / audio['Fs'],
+                      'hashes_stored': stored})
+
+        parts = [stream.close() for stream in streams]
+        pending.extend(parts)
+        fingerprints = self._keep_for_cache(fingerprints, parts)
+        stored += self._flush(pending, song)
+        self._save_bloom_filter()
+        progress({'channels_done': channels, 'hashes_stored': stored})
+
+        if fingerprints is not None:
+            self.fingerprint_cache.put(
+                file_hash, fingerprint_service.signature, audio['Fs'],
+                [tuple(np.concatenate(column) for column in zip(*channel))
+                 for channel in fingerprints])
+
+        msg = '   finished fingerprinting, stored %d unique hashes'
+        logging.info(msg, stored)
+
+    @staticmethod
+    def _profile(profile):
+        """`profile`, else the one the app's FINGERPRINT_PROFILE setting
+        names, else DEFAULT_FINGERPRINT_PROFILE
+        """
+        profile = profile or current_app.config.get(
+            "FINGERPRINT_PROFILE", DEFAULT_FINGERPRINT_PROFILE)
+
+        if profile not in FINGERPRINT_PROFILES:
+            raise ValueError("unknown fingerprint profile %r" % profile)
+
+        return profile
+
+    def ingest_directory(self, directory, workers=None, profile=None):
+        """Ingests every audio file under `directory` not stored yet,
+        fingerprinted with `profile`.
+
+        Files are hashed and fingerprinted by a pool of `workers` processes
+        while this process, the only one talking to the database, stores
+        the results as they come in.
+        """
+        filenames = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory)
+            for name in names
+            if name.lower().endswith(AUDIO_FILE_EXTENSIONS))
+
+        workers = workers or os.cpu_count()
+        profile = self._profile(profile)
+        started = time.perf_counter()
+        ingested = 0
+        stored = 0
+
+        # spawned workers do not inherit the database connections
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            file_hashes = executor.map(
+                self.audio_service.parse_file_hash, filenames, chunksize=16)
+
+            queue = []
+            seen = set()
+            for filename, file_hash in zip(filenames, file_hashes):
+                if file_hash in seen or \
+                        self.song_repo.get_by_file_hash(file_hash):
+                    continue
+
+                seen.add(file_hash)
+                queue.append((filename, file_hash))
+
+            total = len(queue)
+            logging.info("ingesting %d of %d files with %d workers",
+                         total, len(filenames), workers)
+
+            # only a couple of files per worker are in flight at a time, so
+            # fingerprints waiting for the database do not pile up, and each
+            # future is dropped as soon as it is stored
+            queue = iter(queue)
+            running = set()
+            while True:
+                for filename, file_hash in islice(
+                        queue, 2 * workers - len(running)):
+                    running.add(executor.submit(
+                        fingerprint_file, filename, file_hash, profile))
+
+                if not running:
+                    break
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception:
+                        logging.exception("could not fingerprint a file")
+                        continue
+
+                    song = self.song_repo.upsert(
+                        {
+                            'name': os.path.basename(result['filename']),
+                            'file_hash': result['file_hash'],
+                            'profile': profile
+                        }
+                    )
+                    try:
+                        stored += self._store(song, result['fingerprints'])
+                    except Exception:
+                        logging.exception("could not store %s",
+                                          result['filename'])
+                        self._discard(song)
+                        continue
+
+                    ingested += 1
+
+                    elapsed = time.perf_counter() - started
+                    logging.info(
+                        "%d/%d files, %.1f files/min, %d hashes/s: %s",
+                        ingested, total, ingested / elapsed * 60,
+                        stored / elapsed, result['filename'])
+
+        # once for the whole run, as each save goes through the whole file
+        self._save_bloom_filter(force=True)
+
+        return ingested
+
+    def _flush(self, pending, song):
+        if not pending:
+            return 0
+
+        fingerprints = np.unique(np.concatenate(
+            [np.stack([hashes, offsets], axis=1) for hashes, offsets in pending]
+        ), axis=0)
+
+        return self._store(song, fingerprints)
+
+    @staticmethod
+    def _keep_for_cache(fingerprints, parts):
+        """Appends the (hashes, offsets) `parts` of every channel to
+        `fingerprints`; gives them up, returning None, once they hold more
+        than FINGERPRINT_CACHE_MAX_HASHES hashes
+        """
+        if fingerprints is None:
+            return None
+
+        for channel, part in zip(fingerprints, parts):
+            channel.append(part)
+
+        kept = sum(len(hashes) for channel in fingerprints
+                   for hashes, _ in channel)
+        if kept > FINGERPRINT_CACHE_MAX_HASHES:
+            logging.debug('   too many hashes to cache, %d so far', kept)
+            return None
+
+        return fingerprints
+
+    def _discard(self, song):
+        """Deletes a song whose ingest failed along with the fingerprints
+        stored so far; fingerprint indexes keep those until rebuilt, and
+        recognitions skip them
+        """
+        logging.warning('   discarding song %d', song.id)
+
+        self.fingerprint_repo.delete_by_song(song)
+        self.song_repo.delete(song)
+
+    def _save_bloom_filter(self, force=False):
+        """Persists the hashes stored in the Bloom filter, so a restart does
+        not take them for misses; at most every BLOOM_FILTER_SYNC_SECONDS
+        unless `force`
+        """
+        if self.bloom_filter is not None:
+            self.bloom_filter.save(force=force)
+
+    def _store(self, song, fingerprints):
+        """Stores an (n, 2) array of unique (hash, offset) rows of `song`,
+        but those of stop hashes when STOP_HASH_SKIP_INGEST is on
+        """
+        if self.stop_hashes is not None and self.stop_hashes.skip_ingest:
+            stop = self.stop_hashes.contains(fingerprints[:, 0])
+            fingerprints = fingerprints[~stop]
+            metrics.count("stop_hashes_skipped", int(stop.sum()))
+
+        if not len(fingerprints):
+            return 0
+
+        msg = '   storing %d hashes in db'
+        logging.debug(msg, len(fingerprints))
+
+        # raises when the rows could not all be stored, before the index
+        # or the progress learn about them
+        stored = self.fingerprint_repo.upsert_bulk(
+            ({"hash": hash, "offset": offset}
+             for hash, offset in fingerprints.tolist()), song,
+            batch_size=self.batch_size)
+
+        if self.fingerprint_index is not None:
+            self.fingerprint_index.add(
+                song.id, fingerprints[:, 0], fingerprints[:, 1])
+
+        return stored
+
+
+def fingerprint_file(filename, file_hash=None,
+                     profile=DEFAULT_FINGERPRINT_PROFILE):
+    """Fingerprints every channel of a file without touching the database;
+    runs in the worker processes of IngestService.ingest_directory
+    """
+    audio_service = AudioService()
+    audio = audio_service.stream_audio(filename, file_hash=file_hash)
+    fingerprint_service = FingerprintService(profile)
+    profile = FINGERPRINT_PROFILES[profile]
+
+    channels = 1 if profile['mono'] else audio['channels']
+    streams = [fingerprint_service.stream(Fs=profile['fs'] or audio['Fs'])
+               for _ in range(channels)]
+    fingerprints = []
+
+    for chunk in audio['chunks']:
+        chunk, _ = audio_service.conform(chunk, audio['Fs'], profile)
+        for stream, channel in zip(streams, chunk):
+            fingerprints.append(np.stack(stream.feed(channel), axis=1))
+
+    for stream in streams:
+        fingerprints.append(np.stack(stream.close(), axis=1))
+
+    return {
+        'filename': filename,
+        'file_hash': audio['file_hash'],
+        'fingerprints': np.unique(np.concatenate(fingerprints), axis=0)
+    }
@@ -1,130 +1,472 @@
-from itertools import zip_longest
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from ..configs.fingerprint import DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE
+import numpy as np
+
+from ..configs.fingerprint import (DEFAULT_FINGERPRINT_PROFILE,
+                                   FINGERPRINT_HASH_MODE,
+                                   RECOGNITION_CANDIDATE_SONGS,
+                                   RECOGNITION_CONFIDENCE_MARGIN,
+                                   RECOGNITION_MIN_CONFIDENCE,
+                                   RECOGNITION_SLICE_SECONDS, RECOGNITION_TOP_N)
+from ..caches import get_bloom_filter, get_fingerprint_cache
+from ..filters import get_stop_hashes
+from ..indexes import get_fingerprint_index
+from ..metrics import metrics
 from ..repositories import FingerprintRepository, SongRepository
+from .audio import AudioService
 from .fingerprint import FingerprintService
 
 
 class SongService:
-    def __init__(self, audio) -> None:
+    def __init__(self, audio=None, file_hash=None, decode=None,
+                 profiles=None) -> None:
+        """`audio` is the sample as returned by AudioService.parse_audio;
+        instead, give its `file_hash` and a `decode` function returning it,
+        only called when the fingerprint cache misses. The sample is
+        fingerprinted with the given `profiles`, (profile, hash mode) pairs
+        as SongRepository.get_profiles returns them, by default every pair
+        found in the catalog.
+        """
         self.song_repo = SongRepository()
         self.fingerprint_repo = FingerprintRepository()
-        self.fingerprint_service = FingerprintService()
+        self.audio_service = AudioService()
+        self.fingerprint_index = get_fingerprint_index()
+        self.fingerprint_cache = get_fingerprint_cache()
+        self.stop_hashes = get_stop_hashes()
+        self.bloom_filter = get_bloom_filter()
 
-        self.audio = audio
+        if profiles is None:
+            profiles = self.song_repo.get_profiles()
 
-    def recognize(self):
-        matches = []
-        data = self.audio['channels']
-        channel_amount = len(data)
+        self.fingerprint_services = {
+            (profile, hash_mode): FingerprintService(profile, hash_mode)
+            for profile, hash_mode in profiles or
+            [(DEFAULT_FINGERPRINT_PROFILE, FINGERPRINT_HASH_MODE)]
+        }
 
-        for channeln, channel in enumerate(data):
-            msg = '   fingerprinting channel %d/%d'
-            print(msg % (channeln+1, channel_amount))
+        self.file_hash = file_hash or audio['file_hash']
+        self.Fs = audio['Fs'] if audio else None
+        self._audio = audio
+        self._decode = decode
+
+    @property
+    def audio(self):
+        if self._audio is None:
+            self._audio = self._decode()
+            self.Fs = self._audio['Fs']
 
-            channel_hashes = self.fingerprint_service.fingerprint(
-                channel, Fs=self.audio['Fs'])
+        return self._audio
 
-            matches.extend(self._return_matches(channel_hashes))
+    @property
+    def _postings(self):
+        """Where hashes are looked up: the fingerprint index when there is
+        one, else the repository, which reads all of them in one statement
+        and answers hot ones from the postings cache in front of it
+        """
+        if self.fingerprint_index is not None:
+            return self.fingerprint_index
 
-            msg = '   finished channel %d/%d, got %d hashes'
-            print(msg % (
-                channeln+1, channel_amount, len(matches)
-            ))
+        return self.fingerprint_repo
 
-        total_matches_found = len(matches)
+    @metrics.timed("recognize")
+    def recognize(self, top_n=RECOGNITION_TOP_N, incremental=False,
+                  candidates=RECOGNITION_CANDIDATE_SONGS):
+        # stopping early saves nothing once the fingerprints are cached
+        if incremental and not self._cached():
+            song_ids, diffs = self._incremental_matches()
+        elif candidates and self.fingerprint_index is None:
+            song_ids, diffs = self._candidate_matches(max(candidates, top_n))
+        else:
+            song_ids, diffs = self._all_matches()
+
+        total_matches_found = len(song_ids)
 
         if total_matches_found > 0:
             msg = ' ** totally found %d hash matches'
-            print(msg % total_matches_found)
+            logging.info(msg, total_matches_found)
 
-            song = self._align_matches(matches)
+            songs = self._align_matches(song_ids, diffs, top_n=top_n)
 
             msg = ' => song: %s (id=%d)\n'
             msg += '    offset: %d (%d secs)\n'
             msg += '    confidence: %d'
 
-            print(msg % (
-                song['SONG_NAME'], song['SONG_ID'],
-                song['OFFSET'], song['OFFSET_SECS'],
-                song['CONFIDENCE']
-            ))
+            for song in songs:
+                logging.info(
+                    msg,
+                    song['SONG_NAME'], song['SONG_ID'],
+                    song['OFFSET'], song['OFFSET_SECS'],
+                    song['CONFIDENCE']
+                )
+
+            return songs
         else:
             msg = ' ** not matches found at all'
-            print(msg)
+            logging.info(msg)
+
+            return []
+
+    def _cached(self):
+        return self.fingerprint_cache is not None and all(
+            self.fingerprint_cache.contains(self.file_hash, service.signature)
+            for service in self.fingerprint_services.values())
+
+    def _fingerprint(self, name, fingerprint_service):
+        """Returns the (hashes, offsets) of every channel of the sample for
+        one profile, from the fingerprint cache when it has them
+        """
+        signature = fingerprint_service.signature
+
+        if self.fingerprint_cache is not None:
+            cached = self.fingerprint_cache.get(self.file_hash, signature)
+
+            if cached:
+                msg = '   found fingerprints of %d channels in cache (%s)'
+                logging.debug(msg, len(cached['fingerprints']), name)
+
+                self.Fs = cached['Fs']
+                return cached['fingerprints']
+
+        data, fs = self.audio_service.conform(
+            self.audio['channels'], self.audio['Fs'],
+            fingerprint_service.profile)
+        channel_amount = len(data)
+
+        fingerprints = []
+        for channeln, channel in enumerate(data):
+            msg = '   fingerprinting channel %d/%d (%s)'
+            logging.debug(msg, channeln+1, channel_amount, name)
+
+            fingerprints.append(fingerprint_service.fingerprint(
+                channel, Fs=fs))
+
+        if self.fingerprint_cache is not None:
+            self.fingerprint_cache.put(
+                self.file_hash, signature, self.audio['Fs'], fingerprints)
+
+        return fingerprints
+
+    @classmethod
+    @metrics.timed("recognize_batch")
+    def recognize_batch(cls, samples, top_n=RECOGNITION_TOP_N, workers=None):
+        """Recognizes many samples at once and returns the matches of each.
+
+        `samples` are dicts of SongService arguments. The samples are
+        fingerprinted by `workers` threads, then the hashes of all of them
+        are looked up together, so each stored hash is read only once, and
+        the postings are split back per sample to be aligned.
+        """
+        if not samples:
+            return []
+
+        profiles = SongRepository().get_profiles()
+        services = [cls(profiles=profiles, **sample) for sample in samples]
+
+        def fingerprint(service):
+            return [cls._unique_query(hashes, offsets)
+                    for name, fingerprint_service
+                    in service.fingerprint_services.items()
+                    for hashes, offsets
+                    in service._fingerprint(name, fingerprint_service)]
+
+        # a copy of the context per task, so the stage timings still add up
+        # in the request's (see metrics.collect_request)
+        with ThreadPoolExecutor(workers) as executor:
+            queries = [future.result() for future in [
+                executor.submit(contextvars.copy_context().run,
+                                fingerprint, service)
+                for service in services]]
+
+        postings = services[0]._postings
+        query_hashes = np.unique(np.concatenate(
+            [hashes for sample in queries for hashes, _ in sample] +
+            [np.empty(0, dtype=np.int64)]))
+        query_hashes = query_hashes[services[0]._informative(query_hashes)]
+
+        with metrics.time("lookup"):
+            hashes, sids, offsets = \
+                postings.get_postings_by_hashes(query_hashes)
+        metrics.count("matches", len(hashes))
+
+        msg = '   ** found %d hash matches for %d samples (%d hashes)'
+        logging.debug(msg, len(hashes), len(samples), len(query_hashes))
+
+        order = np.argsort(hashes, kind="stable")
+        hashes, sids, offsets = hashes[order], sids[order], offsets[order]
+
+        return [
+            service._align_matches(
+                *cls._query_matches(sample, hashes, sids, offsets),
+                top_n=top_n)
+            for service, sample in zip(services, queries)
+        ]
+
+    @staticmethod
+    def _unique_query(hashes, offsets):
+        """Sorted unique hashes of a channel with the offset each one is
+        looked up with, the last one, as in _return_matches
+        """
+        query_hashes, last = np.unique(hashes[::-1], return_index=True)
+
+        return query_hashes, offsets[::-1][last]
+
+    @classmethod
+    def _query_matches(cls, queries, hashes, song_ids, offsets):
+        """Returns the (song_ids, diffs) arrays of a list of
+        _unique_query's out of postings sorted by hash
+        """
+        query_song_ids = []
+        diffs = []
+        for query in queries:
+            split_song_ids, split_diffs = cls._split_postings(
+                hashes, song_ids, offsets, *query)
+            query_song_ids.append(split_song_ids)
+            diffs.append(split_diffs)
+
+        return cls._concatenate_matches(query_song_ids, diffs)
+
+    @staticmethod
+    def _split_postings(hashes, song_ids, offsets, query_hashes,
+                        query_offsets):
+        """Picks the postings of one query out of postings sorted by hash and
+        returns its (song_ids, diffs) arrays
+        """
+        starts = np.searchsorted(hashes, query_hashes)
+        counts = np.searchsorted(hashes, query_hashes, side="right") - starts
+
+        # indexes of every posting of every query hash, in query order
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+            np.arange(counts.sum())
+
+        return (song_ids[positions].astype(np.int64),
+                offsets[positions] - np.repeat(query_offsets, counts))
+
+    def _all_matches(self):
+        song_ids = []
+        diffs = []
+
+        for name, fingerprint_service in self.fingerprint_services.items():
+            fingerprints = self._fingerprint(name, fingerprint_service)
+            channel_amount = len(fingerprints)
+
+            for channeln, channel_hashes in enumerate(fingerprints):
+                channel_song_ids, channel_diffs = \
+                    self._return_matches(channel_hashes)
+                song_ids.append(channel_song_ids)
+                diffs.append(channel_diffs)
+
+                msg = '   finished channel %d/%d, got %d hashes'
+                logging.debug(
+                    msg,
+                    channeln+1, channel_amount, sum(map(len, song_ids))
+                )
+
+        return self._concatenate_matches(song_ids, diffs)
+
+    def _candidate_matches(self, candidates):
+        """Two stage lookup in the database: the matching fingerprints of
+        every song are counted for all hashes of the sample at once, then
+        only the postings of the `candidates` songs with most matches are
+        aligned (see FingerprintRepository.get_candidate_postings)
+        """
+        queries = [
+            self._unique_query(hashes, offsets)
+            for name, fingerprint_service in self.fingerprint_services.items()
+            for hashes, offsets in self._fingerprint(name, fingerprint_service)
+        ]
+        query_hashes = np.unique(np.concatenate(
+            [hashes for hashes, _ in queries] +
+            [np.empty(0, dtype=np.int64)]))
+        query_hashes = query_hashes[self._informative(query_hashes)]
+
+        with metrics.time("lookup"):
+            hashes, sids, offsets = self.fingerprint_repo \
+                .get_candidate_postings(query_hashes, candidates)
+        metrics.count("matches", len(hashes))
+
+        msg = '   ** found %d hash matches of %d candidate songs (%d hashes)'
+        logging.debug(msg, len(hashes), len(np.unique(sids)),
+                      len(query_hashes))
+
+        order = np.argsort(hashes, kind="stable")
+        return self._query_matches(
+            queries, hashes[order], sids[order], offsets[order])
+
+    def _incremental_matches(self,
+                             slice_seconds=RECOGNITION_SLICE_SECONDS,
+                             min_confidence=RECOGNITION_MIN_CONFIDENCE,
+                             margin=RECOGNITION_CONFIDENCE_MARGIN):
+        """Fingerprints and looks up the sample `slice_seconds` at a time and
+        stops once the best song has `min_confidence` aligned matches and at
+        least `margin` times as many as the runner-up.
+
+        The sample is downmixed and resampled for every profile at once, so
+        the slices fed to the fingerprint streams line up with the samples
+        of a whole-sample fingerprint whatever the resampling ratio.
+        """
+        song_ids = []
+        diffs = []
+
+        streams = []
+        for fingerprint_service in self.fingerprint_services.values():
+            data, fs = self.audio_service.conform(
+                self.audio['channels'], self.audio['Fs'],
+                fingerprint_service.profile)
+            streams.append((data, max(int(slice_seconds * fs), 1), [
+                fingerprint_service.stream(Fs=fs) for _ in data]))
+
+        length = max(map(len, self.audio['channels']), default=0)
+        seconds = length / self.audio['Fs']
+        slices = max([-(-len(channel) // step)
+                      for data, step, _ in streams for channel in data],
+                     default=0)
+
+        for n in range(slices):
+            hashes = []
+            offsets = []
+            for data, step, profile_streams in streams:
+                for stream, channel in zip(profile_streams, data):
+                    slice_hashes, slice_offsets = stream.feed(
+                        channel[n * step:(n + 1) * step])
+                    hashes.append(slice_hashes)
+                    offsets.append(slice_offsets)
+
+            slice_song_ids, slice_diffs = self._return_matches(
+                (np.concatenate(hashes), np.concatenate(offsets)))
+            song_ids.append(slice_song_ids)
+            diffs.append(slice_diffs)
+
+            _, _, counts = self._score_matches(
+                *self._concatenate_matches(song_ids, diffs), top_n=2)
+            counts = counts.tolist() + [0, 0]
+
+            if counts[0] >= min_confidence and counts[0] >= margin * counts[1]:
+                msg = '   confident after %.1f of %.1f secs'
+                logging.info(
+                    msg, min((n + 1) * slice_seconds, seconds), seconds)
+                return self._concatenate_matches(song_ids, diffs)
+
+        # the sample ended before any song stood out
+        hashes, offsets = zip(*[stream.close()
+                                for _, _, profile_streams in streams
+                                for stream in profile_streams])
+        slice_song_ids, slice_diffs = self._return_matches(
+            (np.concatenate(hashes), np.concatenate(offsets)))
+        song_ids.append(slice_song_ids)
+        diffs.append(slice_diffs)
+
+        return self._concatenate_matches(song_ids, diffs)
 
     @staticmethod
-    def _grouper(iterable, n, fillvalue=None):
-        args = [iter(iterable)] * n
-        result = []
-        for values in zip_longest(fillvalue=fillvalue, *args):
-            if values is not fillvalue:
-                result.append(values)
-        return result
+    def _concatenate_matches(song_ids, diffs):
+        if not song_ids:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        return np.concatenate(song_ids), np.concatenate(diffs)
 
     def _return_matches(self, hashes):
+        """Returns the (song_ids, diffs) arrays of every stored hash matching
+        `hashes`, where diff = db_offset - song_sampled_offset
+        """
+        hashes, offsets = hashes
+
         mapper = {}
-        for hash, offset in hashes:
+        for hash, offset in zip(hashes.tolist(), offsets.tolist()):
             mapper[hash] = offset
-        values = mapper.keys()
-
-        for split_values in self._grouper(values, 1000):
-            fingerpints = self.fingerprint_repo.get_all_by_hashes(split_values)
-            matches_found = len(fingerpints)
-
-            if matches_found > 0:
-                msg = '   ** found %d hash matches (step %d/%d)'
-                print(msg % (
-                    matches_found,
-                    len(split_values),
-                    len(values)
-                ))
-            else:
-                msg = '   ** not matches found (step %d/%d)'
-                print(msg % (
-                    len(split_values),
-                    len(values)
-                ))
-
-            for fingerprint in fingerpints:
-                # (sid, db_offset - song_sampled_offset)
-                hash = fingerprint.hash
-                sid = fingerprint.song_id
-                offset = fingerprint.offset
-                yield (sid, offset - mapper[hash])
-
-    def _align_matches(self, matches):
-        diff_counter = {}
-        largest = 0
-        largest_count = 0
-        song_id = -1
-
-        for tup in matches:
-            sid, diff = tup
-
-            if diff not in diff_counter:
-                diff_counter[diff] = {}
-
-            if sid not in diff_counter[diff]:
-                diff_counter[diff][sid] = 0
-
-            diff_counter[diff][sid] += 1
-
-            if diff_counter[diff][sid] > largest_count:
-                largest = diff
-                largest_count = diff_counter[diff][sid]
-                song_id = sid
-
-        songM = self.song_repo.get_by_id(song_id)
-
-        nseconds = round(float(largest) / self.audio['Fs'] *
-                         DEFAULT_WINDOW_SIZE *
-                         DEFAULT_OVERLAP_RATIO, 5)
-
-        return {
-            "SONG_ID": song_id,
-            "SONG_NAME": songM.name,
-            "CONFIDENCE": largest_count,
-            "OFFSET": int(largest),
-            "OFFSET_SECS": nseconds
-        }
+
+        return self._return_index_matches(mapper, self._postings)
+
+    def _return_index_matches(self, mapper, postings):
+        """Looks the hashes of `mapper` up in anything with a
+        get_postings_by_hashes, the fingerprint indexes or the repository
+        """
+        query_hashes = np.fromiter(mapper.keys(), dtype=np.int64)
+        query_offsets = np.fromiter(mapper.values(), dtype=np.int64)
+
+        order = np.argsort(query_hashes)
+        order = order[self._informative(query_hashes[order])]
+        query_hashes, query_offsets = query_hashes[order], query_offsets[order]
+
+        with metrics.time("lookup"):
+            hashes, sids, offsets = \
+                postings.get_postings_by_hashes(query_hashes)
+        metrics.count("matches", len(hashes))
+
+        msg = '   ** found %d hash matches (%d hashes)'
+        logging.debug(msg, len(hashes), len(query_hashes))
+
+        diffs = offsets - query_offsets[np.searchsorted(query_hashes, hashes)]
+        return sids.astype(np.int64), diffs
+
+    def _informative(self, query_hashes):
+        """Boolean mask of the query hashes worth looking up: all of them
+        but the stop hashes and those the Bloom filter knows are not stored
+        """
+        informative = np.ones(len(query_hashes), dtype=bool)
+
+        if self.stop_hashes is not None:
+            stop = self.stop_hashes.contains(query_hashes)
+            metrics.count("stop_hashes_skipped", int(stop.sum()))
+            informative &= ~stop
+
+        if self.bloom_filter is not None:
+            stored = self.bloom_filter.contains(query_hashes)
+            metrics.count("bloom_filter_skipped",
+                          int((informative & ~stored).sum()))
+            informative &= stored
+
+        return informative
+
+    @staticmethod
+    def _score_matches(song_ids, diffs, top_n=RECOGNITION_TOP_N):
+        """Scores every (song_id, diff) pair at once and returns the
+        (song_ids, diffs, counts) arrays of the top_n songs, each with the
+        diff most of its matches agree on
+        """
+        if not len(song_ids):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        # pack each (song_id, diff) pair into one non-negative integer key
+        min_diff = int(diffs.min())
+        span = int(diffs.max()) - min_diff + 1
+        keys, counts = np.unique(
+            song_ids.astype(np.int64) * span + (diffs - min_diff),
+            return_counts=True)
+
+        # the first key of each song in count order is its best alignment
+        order = np.argsort(-counts, kind="stable")
+        keys, counts = keys[order], counts[order]
+        _, best = np.unique(keys // span, return_index=True)
+        best = best[np.argsort(-counts[best], kind="stable")][:top_n]
+
+        return keys[best] // span, keys[best] % span + min_diff, counts[best]
+
+    @metrics.timed("align")
+    def _align_matches(self, song_ids, diffs, top_n=RECOGNITION_TOP_N):
+        songs = []
+        for song_id, largest, count in zip(
+                *(column.tolist() for column in
+                  self._score_matches(song_ids, diffs, top_n=top_n))):
+            songM = self.song_repo.get_by_id(song_id)
+
+            # an index can still hold postings of a song whose ingest failed
+            if songM is None:
+                continue
+
+            fingerprint_service = self.fingerprint_services[
+                songM.profile, songM.hash_mode]
+            nseconds = fingerprint_service.seconds(largest, Fs=self.Fs)
+
+            songs.append({
+                "SONG_ID": song_id,
+                "SONG_NAME": songM.name,
+                "CONFIDENCE": count,
+                "OFFSET": largest,
+                "OFFSET_SECS": nseconds
+            })
+
+        return songs
@@ -0,0 +1,77 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+
+from ..configs.fingerprint import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+                                   DEFAULT_WINDOW_SIZE, STFT_BLOCK_FRAMES)
+
+
+class SpectrogramService:
+    """Log power spectrogram computed in float32.
+
+    Produces the same values as 10 * log10 of matplotlib's
+    mlab.specgram(x, NFFT=wsize, Fs=Fs, window=mlab.window_hanning,
+    noverlap=int(wsize * wratio)), up to float32 precision, with -inf
+    replaced by 0. Frames are strided views over the samples and are
+    windowed and transformed STFT_BLOCK_FRAMES at a time straight into the
+    output array, which is then log transformed in place.
+    """
+
+    def spectrogram(self, samples, Fs=DEFAULT_FS,
+                    wsize=DEFAULT_WINDOW_SIZE,
+                    wratio=DEFAULT_OVERLAP_RATIO,
+                    block_frames=STFT_BLOCK_FRAMES):
+        hop = wsize - int(wsize * wratio)
+
+        # like specgram(), a signal shorter than a window is zero padded
+        if len(samples) < wsize:
+            samples = np.concatenate(
+                [samples, np.zeros(wsize - len(samples), samples.dtype)])
+
+        frames = np.lib.stride_tricks.sliding_window_view(
+            samples, wsize)[::hop]
+        window, scale = _window(wsize, Fs)
+
+        # (time, frequency) in memory, returned as a (frequency, time) view
+        arr2D = np.empty((len(frames), wsize // 2 + 1), dtype=np.float32)
+
+        for start in range(0, len(frames), block_frames):
+            block = arr2D[start:start + block_frames]
+
+            spectrum = fft.rfft(
+                frames[start:start + block_frames] * window, axis=1,
+                overwrite_x=True)
+            np.abs(spectrum, out=block)
+            np.square(block, out=block)
+            block *= scale
+
+        with np.errstate(divide='ignore'):
+            np.log10(arr2D, out=arr2D)
+        arr2D *= 10
+        arr2D[np.isneginf(arr2D)] = 0  # replace infs with zeros
+
+        return arr2D.T
+
+
+@lru_cache(maxsize=16)
+def _window(wsize, Fs):
+    """Hann window and the per bin PSD scaling of specgram(), in float32"""
+    window = np.hanning(wsize)
+
+    # one sided density: every bin but DC (and Nyquist, for even sizes)
+    # is doubled, then everything is divided by Fs and the window energy
+    scale = np.full(wsize // 2 + 1, 2.0)
+    scale[0] = 1
+    if not wsize % 2:
+        scale[-1] = 1
+    scale /= Fs * (window ** 2).sum()
+
+    window = window.astype(np.float32)
+    scale = scale.astype(np.float32)
+
+    # shared by every caller through the cache
+    window.flags.writeable = False
+    scale.flags.writeable = False
+
+    return window, scale
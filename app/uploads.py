@@ -0,0 +1,38 @@
+import tempfile
+from hashlib import sha1
+
+from flask import Request
+
+from .configs.fingerprint import UPLOAD_SPOOL_MAX_SIZE
+
+
+class UploadFile(tempfile.SpooledTemporaryFile):
+    """Buffer an upload is written to as it arrives, kept in memory up to
+    UPLOAD_SPOOL_MAX_SIZE bytes, which hashes the bytes on the way; see
+    AudioService.spool
+    """
+
+    def __init__(self, max_size=UPLOAD_SPOOL_MAX_SIZE) -> None:
+        super().__init__(max_size, mode="w+b")
+        self._sha1 = sha1()
+
+    @property
+    def file_hash(self):
+        """Hash of the bytes written, the same parse_file_hash gives for
+        the file
+        """
+        return self._sha1.hexdigest().upper()
+
+    def write(self, s):
+        self._sha1.update(s)
+        return super().write(s)
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files are UploadFile's, so they are spooled and
+    hashed once, while the form is parsed
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return UploadFile()
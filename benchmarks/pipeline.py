@@ -0,0 +1,234 @@
+"""Times every stage of the fingerprint pipeline on synthetic audio.
+
+    python -m benchmarks.pipeline --seconds 10 30 120 --output run.json
+
+Each stage runs `--repeat` times and reports its median time, throughput
+and the peak memory traced during one more run, as JSON, so runs on two
+commits can be diffed. Database stages use a throwaway SQLite file unless
+--database points somewhere else, where the songs and fingerprints they
+store are deleted at the end. Only WAV files are decoded, so ffmpeg is not
+needed.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy
+
+from .signals import SIGNALS, synthesize, write_wav
+
+
+def measure(function, repeat):
+    """Runs `function` `repeat` times plus once under tracemalloc and
+    returns (last result, times, peak bytes)
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, times, peak
+
+
+def settings():
+    from app.configs import fingerprint
+
+    return {name: value for name, value in vars(fingerprint).items()
+            if name.isupper() and
+            isinstance(value, (int, float, str, bool, tuple, dict))}
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(kinds, lengths, repeat, database, workdir):
+    from app import app
+    from app.models import db
+    from app.repositories import FingerprintRepository, SongRepository
+    from app.services import AudioService, FingerprintService, SongService
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database
+
+    # the caches, filters and indexes would hide the database from the
+    # lookups
+    for extension in ("fingerprint_index", "fingerprint_cache",
+                      "postings_cache", "bloom_filter", "stop_hashes"):
+        app.extensions.pop(extension, None)
+
+    results = []
+
+    def record(kind, seconds, stage, times, peak, items, unit):
+        median = statistics.median(times)
+        results.append({
+            "signal": kind,
+            "seconds": seconds,
+            "stage": stage,
+            "median_s": median,
+            "min_s": min(times),
+            "runs": len(times),
+            "items": items,
+            "throughput": items / median if median else None,
+            "unit": unit,
+            "peak_memory_bytes": peak,
+        })
+        print("%-6s %5ds %-22s %9.4fs %14.1f %s" % (
+            kind, seconds, stage, median, results[-1]["throughput"] or 0,
+            unit), file=sys.stderr)
+
+    with app.app_context():
+        db.create_all()
+
+        audio_service = AudioService()
+        fingerprint_service = FingerprintService()
+        song_repo = SongRepository()
+        fingerprint_repo = FingerprintRepository()
+
+        songs = []
+        try:
+            for seconds in lengths:
+                for kind in kinds:
+                    filename = os.path.join(workdir, f"{kind}-{seconds}.wav")
+                    write_wav(filename, synthesize(kind, seconds))
+
+                    audio, times, peak = measure(
+                        lambda: audio_service.parse_audio(filename), repeat)
+                    record(kind, seconds, "parse_audio", times, peak,
+                           seconds, "audio s/s")
+
+                    channel = audio["channels"][0]
+
+                    arr2D, times, peak = measure(
+                        lambda: fingerprint_service._spectrogram(
+                            channel, Fs=audio["Fs"]), repeat)
+                    record(kind, seconds, "spectrogram", times, peak,
+                           seconds, "audio s/s")
+
+                    peaks, times, peak = measure(
+                        lambda: fingerprint_service._get_2D_peaks(arr2D),
+                        repeat)
+                    record(kind, seconds, "get_2D_peaks", times, peak,
+                           arr2D.shape[1], "frames/s")
+
+                    (hashes, offsets), times, peak = measure(
+                        lambda: fingerprint_service._generate_hashes(peaks),
+                        repeat)
+                    record(kind, seconds, "generate_hashes", times, peak,
+                           len(hashes), "hashes/s")
+
+                    rows = [{"hash": hash, "offset": offset}
+                            for hash, offset in zip(hashes.tolist(),
+                                                    offsets.tolist())]
+
+                    # every run stores the rows under a song of its own
+                    def insert():
+                        song = song_repo.upsert({
+                            "name": filename,
+                            "file_hash": f"{kind}-{seconds}-{time.time_ns()}"
+                        })
+                        songs.append(song)
+                        return fingerprint_repo.upsert_bulk(rows, song)
+
+                    _, times, peak = measure(insert, repeat)
+                    record(kind, seconds, "upsert_bulk", times, peak,
+                           len(rows), "rows/s")
+
+                    unique = np.unique(hashes)
+
+                    (found_hashes, song_ids, found_offsets), times, peak = \
+                        measure(lambda: fingerprint_repo
+                                .get_postings_by_hashes(unique), repeat)
+                    record(kind, seconds, "get_postings_by_hashes", times,
+                           peak, len(unique), "hashes/s")
+
+                    mapper = dict(zip(hashes.tolist(), offsets.tolist()))
+                    diffs = found_offsets - np.array(
+                        [mapper[hash] for hash in found_hashes.tolist()],
+                        dtype=np.int64)
+                    song_service = SongService(audio)
+
+                    _, times, peak = measure(
+                        lambda: song_service._align_matches(song_ids, diffs),
+                        repeat)
+                    record(kind, seconds, "align_matches", times, peak,
+                           len(song_ids), "matches/s")
+
+                    os.remove(filename)
+        finally:
+            # --database may point to a catalog that is not to be kept
+            for song in songs:
+                fingerprint_repo.delete_by_song(song)
+                song_repo.delete(song)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Times every stage of the fingerprint pipeline.")
+    parser.add_argument("--signals", nargs="+", choices=SIGNALS,
+                        default=list(SIGNALS))
+    parser.add_argument("--seconds", nargs="+", type=int, default=[10, 30])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--database",
+                        help="SQLAlchemy URL, a temporary SQLite by default")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database = args.database or \
+            "sqlite:///" + os.path.join(workdir, "benchmark.db")
+
+        started = time.perf_counter()
+        results = run(args.signals, args.seconds, args.repeat, database,
+                      workdir)
+
+    report = {
+        "commit": commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "elapsed_s": time.perf_counter() - started,
+        # kilobytes on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "settings": settings(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
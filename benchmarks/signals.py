@@ -0,0 +1,48 @@
+"""Deterministic synthetic audio for the benchmarks"""
+import wave
+
+import numpy as np
+from scipy.signal import chirp
+
+SIGNALS = ("tone", "chirp", "noise", "mix")
+
+
+def synthesize(kind, seconds, Fs=44100, channels=2, seed=0):
+    """Returns a (channels, samples) int16 array of `kind` audio; the same
+    arguments always give the same samples
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * Fs)) / Fs
+
+    if kind == "tone":
+        signal = sum(np.sin(2 * np.pi * freq * t) * (0.5 + 0.5 * np.sin(t * k))
+                     for k, freq in enumerate((220.0, 659.3, 1760.0), 1))
+    elif kind == "chirp":
+        signal = chirp(t % 5, f0=100, t1=5, f1=8000, method="logarithmic")
+    elif kind == "noise":
+        signal = rng.standard_normal(len(t))
+    elif kind == "mix":
+        bursts = np.zeros(len(t))
+        bursts[rng.integers(0, len(t), int(seconds * 4))] = 1
+        bursts = np.convolve(bursts, np.exp(-np.arange(2048) / 256))[:len(t)]
+        signal = synthesize("tone", seconds, Fs, 1, seed)[0] / 2**14 + \
+            synthesize("chirp", seconds, Fs, 1, seed)[0] / 2**14 + \
+            bursts * rng.standard_normal(len(t)) + \
+            0.1 * rng.standard_normal(len(t))
+    else:
+        raise ValueError("unknown signal %r" % kind)
+
+    signal = signal / (np.abs(signal).max() or 1) * 0.5 * 2**15
+
+    # later channels are delayed and quieter, as in a real stereo mix
+    return np.stack([
+        np.roll(signal, 11 * chn) * (1 - 0.2 * chn) for chn in range(channels)
+    ]).astype(np.int16)
+
+
+def write_wav(filename, samples, Fs=44100):
+    with wave.open(filename, "wb") as f:
+        f.setnchannels(len(samples))
+        f.setsampwidth(2)
+        f.setframerate(Fs)
+        f.writeframes(samples.T.tobytes())
@@ -0,0 +1,79 @@
+"""Compact fingerprint table
+
+Revision ID: 3b9d2e7c41a6
+Revises: fc39f29885e7
+Create Date: 2026-10-18 09:12:40.514203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2e7c41a6'
+down_revision = 'fc39f29885e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table is rebuilt instead of altered in place: converting every row
+    # with an UPDATE would leave the old tuples behind as dead space.
+    op.create_table('fingerprint_compact',
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.Column('offset', sa.Integer(), nullable=False),
+    sa.Column('song_id', sa.Integer(), nullable=False)
+    )
+
+    # The old hashes are the first 20 hex digits of a SHA1; keep the first 15
+    # (60 bits) so they fit a signed BIGINT, matching FINGERPRINT_HASH_MODE
+    # "sha1" with FINGERPRINT_REDUCTION = 15.
+    op.execute(
+        """
+        INSERT INTO fingerprint_compact (hash, "offset", song_id)
+        SELECT ('x' || lpad(substr(hash, 1, 15), 16, '0'))::bit(64)::bigint,
+               "offset", song_id
+        FROM fingerprint
+        """
+    )
+
+    op.drop_table('fingerprint')
+    op.rename_table('fingerprint_compact', 'fingerprint')
+
+    op.create_foreign_key('fingerprint_song_id_fkey', 'fingerprint', 'song',
+                          ['song_id'], ['id'])
+    op.create_index(op.f('ix_fingerprint_hash'), 'fingerprint', ['hash'],
+                    unique=False)
+
+
+def downgrade():
+    op.create_table('fingerprint_audited',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('created_by', sa.String(length=64), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_by', sa.String(length=64), nullable=False),
+    sa.Column('hash', sa.String(length=200), nullable=False),
+    sa.Column('offset', sa.Integer(), nullable=False),
+    sa.Column('song_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # The digits dropped on upgrade cannot be recovered; hashes come back as
+    # 15 hex digits and the audit columns are stamped with the migration time.
+    op.execute(
+        """
+        INSERT INTO fingerprint_audited
+            (created_at, created_by, updated_at, updated_by,
+             hash, "offset", song_id)
+        SELECT now(), current_user, now(), current_user,
+               lpad(to_hex(hash), 15, '0'), "offset", song_id
+        FROM fingerprint
+        """
+    )
+
+    op.drop_table('fingerprint')
+    op.rename_table('fingerprint_audited', 'fingerprint')
+
+    op.create_foreign_key('fingerprint_song_id_fkey', 'fingerprint', 'song',
+                          ['song_id'], ['id'])
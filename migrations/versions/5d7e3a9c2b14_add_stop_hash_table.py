@@ -0,0 +1,29 @@
+"""Add stop hash table
+
+Revision ID: 5d7e3a9c2b14
+Revises: 8f1c5a2d9e37
+Create Date: 2026-10-18 14:36:52.817604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e3a9c2b14'
+down_revision = '8f1c5a2d9e37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled by `flask rebuildstophashes`
+    op.create_table('stop_hash',
+    sa.Column('hash', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('songs', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade():
+    op.drop_table('stop_hash')
@@ -0,0 +1,26 @@
+"""Add song fingerprint profile
+
+Revision ID: 8f1c5a2d9e37
+Revises: 3b9d2e7c41a6
+Create Date: 2026-10-18 11:02:17.208431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f1c5a2d9e37'
+down_revision = '3b9d2e7c41a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # songs stored so far were fingerprinted at their native rate
+    op.add_column('song', sa.Column('profile', sa.String(length=32),
+                                    nullable=False, server_default='native'))
+
+
+def downgrade():
+    op.drop_column('song', 'profile')
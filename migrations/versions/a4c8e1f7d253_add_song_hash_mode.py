@@ -0,0 +1,26 @@
+"""Add song fingerprint hash mode
+
+Revision ID: a4c8e1f7d253
+Revises: 5d7e3a9c2b14
+Create Date: 2026-10-18 17:12:40.531907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e1f7d253'
+down_revision = '5d7e3a9c2b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # songs stored so far were hashed in "sha1" mode, the default until now
+    op.add_column('song', sa.Column('hash_mode', sa.String(length=8),
+                                    nullable=False, server_default='sha1'))
+
+
+def downgrade():
+    op.drop_column('song', 'hash_mode')
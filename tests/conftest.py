@@ -0,0 +1,33 @@
+import pytest
+
+from app import app as flask_app
+from app.models import db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app on an empty SQLite database in `tmp_path`, without any cache,
+    index or filter; tests register the ones they need in app.extensions
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(flask_app.config, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'test.db'}")
+
+    for name in ("fingerprint_index", "fingerprint_cache", "postings_cache",
+                 "bloom_filter", "stop_hashes"):
+        if name in flask_app.extensions:
+            monkeypatch.delitem(flask_app.extensions, name)
+
+    with flask_app.app_context():
+        db.create_all()
+
+    yield flask_app
+
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
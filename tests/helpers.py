@@ -0,0 +1,83 @@
+"""Songs, samples and GraphQL calls shared by the tests"""
+import io
+import json
+import time
+
+import numpy as np
+
+from benchmarks.signals import synthesize, write_wav
+
+FS = 44100
+
+
+def wav(samples, Fs=FS):
+    """The bytes of a 16 bit WAV file of `samples`"""
+    fileobj = io.BytesIO()
+    write_wav(fileobj, samples, Fs=Fs)
+
+    return fileobj.getvalue()
+
+
+def song_samples(kind, seconds=30, seed=0):
+    return synthesize(kind, seconds, Fs=FS, seed=seed)
+
+
+def sample_of(samples, start, seconds, seed=5):
+    """`seconds` of `samples` from `start` seconds on, with some noise"""
+    sample = samples[:, start * FS:(start + seconds) * FS].astype(np.float32)
+    sample += np.random.default_rng(seed).standard_normal(sample.shape) * 2000
+
+    return np.clip(sample, -32768, 32767).astype(np.int16)
+
+
+def graphql(client, query, files=None, **variables):
+    """Posts a GraphQL query, with `files` as a multipart upload"""
+    files = files or {}
+
+    if not files:
+        response = client.post("/graphql", json={
+            "query": query, "variables": variables})
+        return response.get_json()
+
+    operations = {"query": query,
+                  "variables": dict(variables, **{name: None
+                                                  for name in files})}
+    data = {"operations": json.dumps(operations),
+            "map": json.dumps({name: [f"variables.{name}"]
+                               for name in files})}
+    for name, (filename, content) in files.items():
+        data[name] = (io.BytesIO(content), filename)
+
+    response = client.post("/graphql", data=data,
+                           content_type="multipart/form-data")
+    return response.get_json()
+
+
+def upload(client, filename, content, timeout=60):
+    """Uploads a song and returns its finished ingest job"""
+    result = graphql(
+        client, "mutation($f: Upload!) { upload(musicFile: $f) { jobId } }",
+        {"f": (filename, content)})
+    job_id = result["data"]["upload"]["jobId"]
+
+    deadline = time.monotonic() + timeout
+    while True:
+        job = graphql(
+            client, "query($id: String!) { ingestJob(id: $id) "
+            "{ state songId hashesStored error } }", id=job_id
+        )["data"]["ingestJob"]
+
+        if job["state"] in ("done", "failed") or \
+                time.monotonic() > deadline:
+            return job
+        time.sleep(0.1)
+
+
+def recognize(client, filename, content, **variables):
+    result = graphql(
+        client, "mutation($f: Upload!, $incremental: Boolean) { "
+        "recognition(sampleFile: $f, incremental: $incremental) { "
+        "results { songId songName confidence offset } } }",
+        {"f": (filename, content)}, **variables)
+
+    return result["data"]["recognition"]["results"]
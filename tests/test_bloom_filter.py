@@ -0,0 +1,34 @@
+import numpy as np
+
+from app.caches import BloomFilter
+
+
+def postings(hashes):
+    hashes = np.asarray(hashes, dtype=np.int64)
+    return [(hashes, np.zeros_like(hashes), np.zeros_like(hashes))]
+
+
+def test_added_hashes_survive_a_rebuild_with_another_size(tmp_path):
+    path = str(tmp_path / "bloom.npz")
+    stored = np.arange(1000, dtype=np.int64)
+    added = np.arange(10**6, 10**6 + 500, dtype=np.int64)
+
+    builder = BloomFilter(path, 1000, 0.01, sync_interval=0)
+    builder.build(postings(stored))
+
+    server = BloomFilter(path, 1000, 0.01, sync_interval=0)
+    server.add(added)
+    assert server.contains(added).all()
+
+    # flask buildbloom sizes the file again for a grown table
+    builder.build(postings(stored), hashes=10**5)
+
+    assert server.contains(added).all()
+    assert server.contains(stored).all()
+
+    server.save(force=True)
+
+    reader = BloomFilter(path, 1000, 0.01)
+    assert reader.stats()["bytes"] == builder.stats()["bytes"]
+    assert reader.contains(added).all()
+    assert reader.contains(stored).all()
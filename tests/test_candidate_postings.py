@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from app.caches import PostingsCache
+from app.repositories import FingerprintRepository, SongRepository
+
+
+@pytest.fixture
+def repository(app):
+    """Ten songs sharing a few common hashes, song n holding n + 1 of the
+    query hashes 0 to 9
+    """
+    with app.app_context():
+        repository = FingerprintRepository()
+
+        for n in range(10):
+            song = SongRepository().upsert(
+                {"name": f"song{n}", "file_hash": f"{n:040X}"})
+            hashes = list(range(n + 1)) + list(range(100 + n, 150 + n))
+            repository.upsert_bulk(
+                [{"hash": hash, "offset": offset}
+                 for offset, hash in enumerate(hashes)], song)
+
+        yield repository
+
+
+def sorted_postings(postings):
+    order = np.lexsort(postings[::-1])
+    return [column[order].tolist() for column in postings]
+
+
+@pytest.mark.parametrize("max_cached", [0, 3, 1000])
+def test_cached_candidates_match_the_database(app, repository, monkeypatch,
+                                              max_cached):
+    hashes = np.arange(10)
+    expected = sorted_postings(repository.get_candidate_postings(hashes, 3))
+    assert sorted(set(expected[1])) == [8, 9, 10]
+
+    postings_cache = PostingsCache(2**20)
+    monkeypatch.setitem(app.extensions, "postings_cache", postings_cache)
+
+    for _ in range(2):
+        postings = repository.get_candidate_postings(
+            hashes, 3, max_cached=max_cached)
+        assert sorted_postings(postings) == expected
+
+    # hashes with more than max_cached postings are never cached
+    cached = sum(10 - hash <= max_cached for hash in hashes)
+    assert postings_cache.stats()["entries"] == cached
@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+
+from app.caches import FingerprintCache
+
+
+def fingerprints(n):
+    return [(np.arange(n, dtype=np.int64), np.arange(n, dtype=np.int64))]
+
+
+def test_put_scans_the_directory_only_to_evict(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache")
+    cache = FingerprintCache(path, 100 * 2**10)
+
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir",
+                        lambda path: scans.append(path) or scandir(path))
+
+    for n in range(200):
+        cache.put(f"{n:040X}", "sig", 44100, fingerprints(50))
+
+    # once to count the directory, then once per eviction, which leaves
+    # room for a few more entries
+    assert 1 < len(scans) < 50
+
+    size = sum(entry.stat().st_size for entry in scandir(path))
+    assert size <= 100 * 2**10
+    assert cache.get(f"{199:040X}", "sig") is not None
+    assert cache.get(f"{0:040X}", "sig") is None
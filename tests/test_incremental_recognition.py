@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from app.services import AudioService, IngestService, SongService
+from benchmarks.signals import write_wav
+from helpers import FS, song_samples
+
+
+@pytest.fixture
+def song_file(app, tmp_path):
+    filename = str(tmp_path / "mix.wav")
+    write_wav(filename, song_samples("mix", seconds=20, seed=2))
+
+    with app.app_context():
+        IngestService().ingest(filename, profile="mono_11k")
+
+    return filename
+
+
+def test_incremental_matches_whole_sample_on_resampled_profile(
+        app, tmp_path, song_file):
+    sample = str(tmp_path / "sample.wav")
+    # starting on a frame of the song, so most of its hashes match
+    start = 100 * 4 * 512
+    write_wav(sample, song_samples("mix", seconds=20, seed=2)[
+        :, start:start + 8 * FS])
+
+    with app.app_context():
+        audio = AudioService().parse_audio(sample)
+        service = SongService(audio, profiles=[("mono_11k", "int")])
+
+        whole = service._all_matches()
+        # slices whose length is no multiple of the 44.1 to 11.025 kHz step
+        incremental = service._incremental_matches(
+            slice_seconds=12345 / audio['Fs'], min_confidence=np.inf)
+
+        def pairs(matches):
+            return sorted(zip(*(column.tolist() for column in matches)))
+
+        assert len(whole[0]) > 100
+        assert pairs(incremental) == pairs(whole)
+
+        # stopping early only lowers the confidence
+        first, = service.recognize(incremental=True, top_n=1)
+        expected, = service.recognize(top_n=1)
+        assert (first['SONG_ID'], first['OFFSET']) == \
+            (expected['SONG_ID'], expected['OFFSET'])
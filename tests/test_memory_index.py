@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.indexes import MemoryFingerprintIndex
+
+
+class StoredPostings:
+    """Stands in for the fingerprint repository the index loads from"""
+
+    def __init__(self, *columns) -> None:
+        self.columns = [np.asarray(column, dtype=np.int64)
+                        for column in columns]
+
+    def iter_postings(self):
+        yield tuple(self.columns)
+
+
+def test_add_keeps_the_loaded_segment():
+    index = MemoryFingerprintIndex(
+        StoredPostings([5, 1, 5], [1, 1, 2], [10, 20, 30]), max_segments=4)
+    index.load()
+    loaded = index._segments[0]
+
+    for song_id in range(100, 120):
+        index.add(song_id, np.array([5, song_id]), np.array([0, 1]))
+
+        assert index._segments[0] is loaded
+        assert len(index._segments) <= 5
+
+    hashes, song_ids, offsets = index.get_postings_by_hashes([5, 1, 119])
+    assert len(hashes) == 2 + 1 + 20 + 1
+    assert sorted(song_ids[hashes == 5].tolist()) == \
+        [1, 2] + list(range(100, 120))
+    assert song_ids[hashes == 119].tolist() == [119]
+
+
+def test_add_to_an_empty_table():
+    index = MemoryFingerprintIndex(StoredPostings([], [], []))
+    index.load()
+    index.add(7, np.array([3, 3]), np.array([1, 2]))
+
+    hashes, song_ids, offsets = index.get_postings_by_hashes([3])
+    assert song_ids.tolist() == [7, 7]
+    assert sorted(offsets.tolist()) == [1, 2]
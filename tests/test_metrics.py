@@ -0,0 +1,19 @@
+from helpers import graphql, song_samples, wav
+
+
+def test_batch_stages_reach_the_response(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_GRAPHQL_EXTENSIONS", True)
+
+    result = graphql(
+        client, "mutation($a: Upload!, $b: Upload!) { "
+        "recognizeBatch(sampleFiles: [$a, $b]) { success } }",
+        {"a": ("a.wav", wav(song_samples("noise", 3, seed=1))),
+         "b": ("b.wav", wav(song_samples("chirp", 3, seed=2)))})
+
+    stages = result["extensions"]["stages"]
+    assert result["data"]["recognizeBatch"]["success"]
+
+    # fingerprinted by the batch workers, two channels per sample
+    assert stages["stft"]["count"] == 4
+    assert stages["peaks"]["count"] == 4
+    assert stages["recognize_batch"]["count"] == 1
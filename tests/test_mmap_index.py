@@ -0,0 +1,33 @@
+import numpy as np
+
+from app.indexes import MmapFingerprintIndex
+from helpers import recognize, sample_of, song_samples, upload, wav
+
+
+def test_missing_index_loads_empty(tmp_path):
+    index = MmapFingerprintIndex(str(tmp_path / "missing"))
+
+    hashes, song_ids, offsets = index.get_postings_by_hashes([1, 2, 3])
+    assert len(hashes) == len(song_ids) == len(offsets) == 0
+
+    index.add(7, np.array([2, 1, 2]), np.array([10, 20, 30]))
+
+    hashes, song_ids, offsets = index.get_postings_by_hashes([2, 3])
+    assert hashes.tolist() == [2, 2]
+    assert song_ids.tolist() == [7, 7]
+    assert sorted(offsets.tolist()) == [10, 30]
+
+
+def test_upload_before_buildindex(app, client, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.extensions, "fingerprint_index",
+                        MmapFingerprintIndex(str(tmp_path / "index")))
+
+    samples = song_samples("noise", seed=1)
+    assert recognize(client, "q.wav", wav(sample_of(samples, 10, 8))) == []
+
+    job = upload(client, "noise.wav", wav(samples))
+    assert job["state"] == "done", job["error"]
+    assert job["hashesStored"] > 0
+
+    results = recognize(client, "q.wav", wav(sample_of(samples, 10, 8)))
+    assert results[0]["songId"] == job["songId"]
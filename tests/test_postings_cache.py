@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+
+from app.caches import PostingsCache
+
+EMPTY = (np.empty(0, dtype=np.int64),) * 3
+
+
+def cache_miss(cache, hashes):
+    """Looks `hashes` up, caching them as not stored; returns the hashes
+    the cache missed
+    """
+    _, missing, generation = cache.lookup(hashes)
+    cache.store(missing, EMPTY, generation)
+
+    return missing.tolist()
+
+
+def test_store_in_another_process_drops_the_cache(tmp_path):
+    stamp = str(tmp_path / "postings_cache.stamp")
+    hashes = np.array([1, 2, 3], dtype=np.int64)
+
+    reader = PostingsCache(2**20, stamp)
+    writer = PostingsCache(2**20, stamp)
+
+    assert cache_miss(reader, hashes) == [1, 2, 3]
+    assert cache_miss(reader, hashes) == []
+
+    writer.invalidate(np.array([2], dtype=np.int64))
+
+    assert cache_miss(reader, hashes) == [1, 2, 3]
+    assert cache_miss(reader, hashes) == []
+
+    # a second store right after the first one is still seen
+    writer.invalidate(np.array([3], dtype=np.int64))
+    assert cache_miss(reader, hashes) == [1, 2, 3]
+
+
+def test_cache_expires(tmp_path):
+    hashes = np.array([1, 2], dtype=np.int64)
+    cache = PostingsCache(2**20, ttl=0.05)
+
+    assert cache_miss(cache, hashes) == [1, 2]
+    assert cache_miss(cache, hashes) == []
+
+    time.sleep(0.06)
+    assert cache_miss(cache, hashes) == [1, 2]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from app.indexes import ShardedFingerprintIndex, build_sharded_index
+
+
+class StoredPostings:
+    """Stands in for the fingerprint repository the index is built from"""
+
+    def __init__(self, *columns) -> None:
+        self.columns = [np.asarray(column, dtype=np.int64)
+                        for column in columns]
+
+    def iter_postings(self, ordered=False):
+        order = np.argsort(self.columns[0], kind="stable")
+        yield tuple(column[order] for column in self.columns)
+
+
+@pytest.fixture
+def index(tmp_path):
+    hashes = np.arange(100, dtype=np.int64)
+    build_sharded_index(str(tmp_path), 2, StoredPostings(
+        hashes, np.ones(100), hashes * 2))
+
+    index = ShardedFingerprintIndex(str(tmp_path), 2)
+    yield index
+    index.close()
+
+
+def test_add_skips_songs_already_built(index):
+    hashes = np.arange(100, dtype=np.int64)
+
+    index.add(1, hashes, hashes * 2)
+    index.add(2, hashes[:10], hashes[:10])
+
+    found, song_ids, offsets = index.get_postings_by_hashes(hashes)
+    assert np.bincount(song_ids).tolist() == [0, 100, 10]
+
+
+def test_add_raises_what_failed_in_a_shard(index):
+    hashes = np.arange(10, dtype=np.int64)
+
+    with pytest.raises(RuntimeError, match="ValueError"):
+        index.add(3, hashes, np.array(["x"] * 10))
+
+    # the shards keep serving
+    index.add(3, hashes, hashes)
+    _, song_ids, _ = index.get_postings_by_hashes(hashes)
+    assert sorted(set(song_ids.tolist())) == [1, 3]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from matplotlib import mlab
+from scipy.ndimage import (binary_erosion, generate_binary_structure,
+                           iterate_structure, maximum_filter)
+
+from app.configs.fingerprint import (DEFAULT_AMP_MIN, DEFAULT_OVERLAP_RATIO,
+                                     DEFAULT_WINDOW_SIZE,
+                                     PEAK_NEIGHBORHOOD_SIZE)
+from app.services.fingerprint import FingerprintService
+from app.services.spectrogram import SpectrogramService
+from benchmarks.signals import SIGNALS, synthesize
+
+FS = 44100
+
+
+def reference_spectrogram(samples, Fs=FS, wsize=DEFAULT_WINDOW_SIZE,
+                          wratio=DEFAULT_OVERLAP_RATIO):
+    """The original float64 spectrogram of the fingerprinting"""
+    arr2D = mlab.specgram(samples, NFFT=wsize, Fs=Fs,
+                          window=mlab.window_hanning,
+                          noverlap=int(wsize * wratio))[0]
+
+    with np.errstate(divide='ignore'):
+        arr2D = 10 * np.log10(arr2D)
+    arr2D[arr2D == -np.inf] = 0
+
+    return arr2D
+
+
+def reference_peaks(arr2D, amp_min=DEFAULT_AMP_MIN):
+    """The original peak picking, with maximum_filter over a diamond"""
+    struct = generate_binary_structure(2, 1)
+    neighborhood = iterate_structure(struct, PEAK_NEIGHBORHOOD_SIZE)
+
+    local_max = maximum_filter(arr2D, footprint=neighborhood) == arr2D
+    background = (arr2D == 0)
+    eroded_background = binary_erosion(background, structure=neighborhood,
+                                       border_value=1)
+    detected_peaks = local_max ^ eroded_background
+
+    frequency_idx, time_idx = np.nonzero(detected_peaks & (arr2D > amp_min))
+
+    return np.stack([frequency_idx, time_idx], axis=1)
+
+
+def assert_spectrogram_close(arr2D, expected):
+    """float32 keeps about 7 digits of the power, so only cells within
+    80 dB of the loudest one are compared, which are all a peak can be
+    """
+    assert arr2D.shape == expected.shape
+
+    audible = expected > expected.max() - 80
+    np.testing.assert_allclose(arr2D[audible], expected[audible], atol=1e-2)
+
+
+def signal(kind, seconds=5, silence=0):
+    samples = synthesize(kind, seconds, Fs=FS, channels=1)[0]
+
+    # silence around the signal gives the spectrogram some 0 cells
+    return np.pad(samples, silence * FS)
+
+
+@pytest.mark.parametrize("kind", SIGNALS)
+@pytest.mark.parametrize("wsize", [DEFAULT_WINDOW_SIZE, 1024])
+def test_spectrogram_matches_specgram(kind, wsize):
+    samples = signal(kind)
+
+    expected = reference_spectrogram(samples, wsize=wsize)
+    arr2D = SpectrogramService().spectrogram(samples, Fs=FS, wsize=wsize)
+
+    assert_spectrogram_close(arr2D, expected)
+
+
+def test_spectrogram_of_short_signal_is_padded():
+    samples = signal("tone")[:DEFAULT_WINDOW_SIZE // 2]
+
+    expected = reference_spectrogram(np.pad(
+        samples, (0, DEFAULT_WINDOW_SIZE - len(samples))))
+    arr2D = SpectrogramService().spectrogram(samples, Fs=FS)
+
+    assert_spectrogram_close(arr2D, expected)
+
+
+@pytest.mark.parametrize("kind", SIGNALS)
+@pytest.mark.parametrize("silence", [0, 1])
+def test_peaks_match_maximum_filter(kind, silence):
+    arr2D = SpectrogramService().spectrogram(
+        signal(kind, silence=silence), Fs=FS)
+
+    peaks = FingerprintService()._get_2D_peaks(arr2D)
+
+    np.testing.assert_array_equal(peaks, reference_peaks(arr2D))
+
+
+@pytest.mark.parametrize("kind", SIGNALS)
+@pytest.mark.parametrize("silence", [0, 1])
+def test_peaks_match_original_pipeline(kind, silence):
+    samples = signal(kind, silence=silence)
+
+    expected = reference_peaks(reference_spectrogram(samples))
+    peaks = FingerprintService()._get_2D_peaks(
+        SpectrogramService().spectrogram(samples, Fs=FS))
+
+    np.testing.assert_array_equal(peaks, expected)